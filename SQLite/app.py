@@ -1,14 +1,25 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
-from PIL import Image
-import pytesseract
+from flask import Flask, abort, g, Response, request, jsonify, render_template, redirect, url_for, session, stream_with_context
 import sqlite3
-import re
+import base64
+import json
 import os
-
-# -------------------------
-# OCR config (Windows)
-# -------------------------
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+import time
+from itertools import islice
+from markupsafe import Markup, escape
+
+from batch_match import match_many
+from db import ConnectionPool
+from matcher import add_fuzzy_matches, build_verdict, clean_ocr_text, extract_user_ingredients, extract_user_words
+from metrics import Registry
+from ocr_cache import OcrCache, image_key
+from ocr_jobs import OcrJobQueue, QueueFull
+from rule_snapshot import refresh_snapshot_in_background
+from rule_store import (
+    MARK_END, MARK_START, SORT_COLUMNS, pending_page, prune_rule_changes, review_pending_changes, rules_page,
+    search_rules, sync_rule_ingredients
+)
+from shards import ShardSet, parse_countries, worst_status
+from verdict_cache import token_key, verdict_etag
 
 app = Flask(__name__)
 app.secret_key = "admin_secret_key"
@@ -22,84 +33,50 @@ PROJECT_DIR = os.path.dirname(SQLITE_DIR)
 RULES_DB = os.path.join(PROJECT_DIR, "rules.db")
 USER_DB = os.path.join(SQLITE_DIR, "users.db")
 
+rules_db = ConnectionPool(RULES_DB)
+users_db = ConnectionPool(USER_DB)
+
+# -------------------------
+# Rule shards
 # -------------------------
-# Helper data
-# -------------------------
-SALT_MAP = {
-    "hydrochloride", "hcl",
-    "sodium", "potassium", "calcium", "magnesium",
-    "phosphate", "sulphate", "sulfate",
-    "nitrate", "acetate"
-}
-
-# -------------------------
-# Helper functions
-# -------------------------
-def extract_user_ingredients(text):
-    text = text.lower()
-    words = re.findall(r"[a-z\-]{3,}", text)
-    cleaned = [w for w in words if w not in SALT_MAP]
-    return set(cleaned)
-
-def clean_ocr_text(text):
-    text = text.lower()
-    text = re.sub(r"\d+(mg|ml|mcg)", " ", text)
-    text = re.sub(r"[^a-z\s\-]", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
-
-def check_ingredients(user_tokens):
-    conn = sqlite3.connect(RULES_DB)
-    cur = conn.cursor()
-
-    cur.execute("SELECT name, ingredients, risk_level FROM regulatory_rules")
-    rules = cur.fetchall()
-    conn.close()
-
-    exact_matches = []
-    related_matches = []
-
-    for name, ing_text, risk in rules:
-        if ing_text == "category_only":
-            continue
-
-        rule_tokens = {
-            t.strip()
-            for t in ing_text.split(",")
-            if t.strip() and t.strip() not in SALT_MAP
-        }
-
-        # EXACT harmful match: rule ⊆ input
-        if rule_tokens and rule_tokens.issubset(user_tokens):
-            exact_matches.append(name)
-            continue
-
-        # PARTIAL match
-        if user_tokens & rule_tokens:
-            related_matches.append(name)
-
-    if exact_matches:
-        return {
-            "status": "HIGH RISK",
-            "message": "Exact harmful combination detected.",
-            "exact_matches": exact_matches,
-            "related_matches": [r for r in related_matches if r not in exact_matches]
-        }
-
-    if related_matches:
-        return {
-            "status": "NEEDS REVIEW",
-            "message": "Category-level regulatory match found.",
-            "exact_matches": [],
-            "related_matches": related_matches
-        }
+# one rules database per jurisdiction; RULES_DB is the Indian (default) one
+# and the admin pages, batch screening and OCR all work on it
+shards = ShardSet(PROJECT_DIR)
+default_shard = shards.default()
+rule_cache = default_shard.rule_cache
+verdict_cache = default_shard.verdict_cache
 
-    return {
-        "status": "NO MATCH",
-        "message": "No CDSCO regulatory issues detected.",
-        "exact_matches": [],
-        "related_matches": []
-    }
+# -------------------------
+# Metrics
+# -------------------------
+metrics = Registry()
+REQUESTS = metrics.counter("http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+REQUEST_SECONDS = metrics.histogram("http_request_duration_seconds", "Time to build each response.", ("route", "method"))
+OCR_STAGE_SECONDS = metrics.histogram("ocr_stage_duration_seconds", "Time spent in each /ocr stage.", ("stage",))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # streamed responses (/check/batch) are timed up to their first byte
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUESTS.inc((route, request.method, str(response.status_code)))
+        REQUEST_SECONDS.observe((route, request.method), time.perf_counter() - start)
+    return response
+
+def record_ocr_stages(timings):
+    for stage, seconds in timings.items():
+        OCR_STAGE_SECONDS.observe((stage,), seconds)
+
+def check_ingredients(user_tokens, index=None):
+    if index is None:
+        index = rule_cache.get_index()
+    exact_matches, related_matches = verdict_cache.match(index, user_tokens)
+    return build_verdict(list(exact_matches), list(related_matches))
 
 # -------------------------
 # Routes
@@ -108,31 +85,337 @@ def check_ingredients(user_tokens):
 def home():
     return render_template("index.html")
 
-@app.route("/check", methods=["POST"])
+@app.route("/check", methods=["GET", "POST"])
 def check():
-    data = request.get_json()
+    # GET /check?ingredients=... is the cacheable form: the ETag covers the
+    # token set and the rule version, so a client or proxy revalidating an
+    # unchanged product gets a 304
+    if request.method == "GET":
+        data = request.args
+        fuzzy = data.get("fuzzy", "").lower() in ("1", "true", "yes")
+    else:
+        data = request.get_json()
+        fuzzy = bool(data.get("fuzzy"))
     ingredients_text = data.get("ingredients", "")
-    user_tokens = extract_user_ingredients(ingredients_text)
-    result = check_ingredients(user_tokens)
-    return jsonify(result)
+
+    words = extract_user_words(ingredients_text)
+    user_tokens = set(words)
+
+    # countries=IN,US screens against each listed jurisdiction; without it
+    # the response keeps the single-shard shape
+    countries = parse_countries(data.get("countries"))
+    targets = [(code, shards.get(code)) for code in countries] or [(default_shard.code, default_shard)]
+    active = [shard for _, shard in targets if shard is not None]
+    if not active:
+        return jsonify({"error": "No rules available for the requested countries", "available": shards.available()}), 400
+    indexes = shards.indexes(active)
+
+    # fuzzy matching also joins adjacent words, so there word order counts
+    version = ".".join(f"{shard.code}{shard.rule_cache.version}" for shard in active) if countries else rule_cache.version
+    if fuzzy:
+        etag = verdict_etag(version, tuple(words), "f")
+    else:
+        etag = verdict_etag(version, token_key(user_tokens))
+    if request.method == "GET" and etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        results = {}
+        for shard, index in zip(active, indexes):
+            result = shard.check(user_tokens, index)
+            if fuzzy:
+                add_fuzzy_matches(result, words, index)
+            results[shard.code] = result
+
+        if countries:
+            for shard in active:
+                results[shard.code].update(shard.info)
+            response = jsonify({
+                "status": worst_status(results.values()),
+                "jurisdictions": results,
+                "unavailable": [code for code, shard in targets if shard is None],
+            })
+        else:
+            response = jsonify(results[default_shard.code])
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# -------------------------
+# Rule search
+# -------------------------
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+@app.template_filter("highlight")
+def highlight(snippet):
+    # escape the rule text, then turn the FTS match markers into <mark>
+    html = str(escape(snippet or ""))
+    return Markup(html.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>"))
+
+def run_search():
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", SEARCH_LIMIT, type=int), MAX_SEARCH_LIMIT))
+
+    with rules_db.read() as cur:
+        return query, search_rules(cur, query, limit)
+
+@app.route("/rules/search")
+def rules_search():
+    query, rows = run_search()
+    return jsonify({
+        "query": query,
+        "results": [
+            {
+                "rule_id": r[0], "name": r[1], "ingredients": r[2], "risk_level": r[3], "type": r[4],
+                "name_snippet": highlight(r[5]), "ingredients_snippet": highlight(r[6]),
+            }
+            for r in rows
+        ],
+    })
+
+# -------------------------
+# Batch screening
+# -------------------------
+def iter_batch_items():
+    # NDJSON bodies are read line by line, anything else must be a JSON
+    # array (or {"items": [...]}) of {id, ingredients} objects
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield {"error": "Invalid JSON line"}
+        return
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        yield {"error": "Expected a JSON array of {id, ingredients} items"}
+        return
+
+    yield from data
+
+BATCH_CHUNK = 256
+
+def batch_item_error(item):
+    if not isinstance(item, dict):
+        return {"error": "Item must be an object"}
+    if "error" in item:
+        return item
+    if not isinstance(item.get("ingredients", ""), str):
+        return {"id": item.get("id"), "error": "ingredients must be a string"}
+    return None
+
+def screen_batch_items(items, index):
+    # valid items of a chunk are matched together in one match_many call
+    results = [batch_item_error(item) for item in items]
+    todo = [i for i, r in enumerate(results) if r is None]
+
+    matches = match_many(index, [extract_user_ingredients(items[i].get("ingredients", "")) for i in todo])
+    for i, (exact, related) in zip(todo, matches):
+        result = build_verdict(exact, related)
+        result["id"] = items[i].get("id")
+        results[i] = result
+    return results
+
+@app.route("/check/batch", methods=["POST"])
+def check_batch():
+    # load the rule set once for the whole batch
+    index = rule_cache.get_index()
+
+    def generate():
+        items = iter_batch_items()
+        while True:
+            chunk = list(islice(items, BATCH_CHUNK))
+            if not chunk:
+                break
+            yield "".join(json.dumps(r) + "\n" for r in screen_batch_items(chunk, index))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# -------------------------
+# OCR
+# -------------------------
+def screen_ocr_text(extracted_text, timings=None):
+    # timings holds the OCR stages already run (decode, preprocessing, ocr)
+    # and gets the screening stages added
+    if timings is None:
+        timings = {}
+
+    start = time.perf_counter()
+    cleaned_text = clean_ocr_text(extracted_text)
+    timings["clean"] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    words = extract_user_words(cleaned_text)
+    timings["tokenize"] = round(time.perf_counter() - start, 4)
+
+    start = time.perf_counter()
+    index = rule_cache.get_index()
+    result = check_ingredients(set(words), index)
+    add_fuzzy_matches(result, words, index)
+    timings["match"] = round(time.perf_counter() - start, 4)
+
+    record_ocr_stages(timings)
+    result["extracted_text"] = extracted_text
+
+    return result
+
+ocr_cache = OcrCache()
+ocr_queue = OcrJobQueue(screen_ocr_text, cache=ocr_cache)
+
+def extract_text(image_bytes, timings):
+    # a known image skips Tesseract and only gets re-screened
+    key = image_key(image_bytes)
+    extracted_text = ocr_cache.get(image_bytes, key)
+    if extracted_text is not None:
+        return extracted_text, True
+
+    # Pillow and pytesseract load on the first OCR request, so workers that
+    # only serve /check never pay for them
+    from ocr import image_to_text
+
+    extracted_text = image_to_text(image_bytes, timings)
+    ocr_cache.put(image_bytes, extracted_text, key)
+    return extracted_text, False
+
+def screen_document(data, stop_early=False):
+    # PDF/TIFF uploads: pages are OCRed in parallel and each one is screened
+    # as it finishes, so with stop_early the first page with an exact
+    # match ends the run. The verdict covers the text of all pages read.
+    from ocr import document_to_text, merge_pages, page_timings
+
+    index = rule_cache.get_index()
+
+    def screen_page(page):
+        words = extract_user_words(clean_ocr_text(page["text"]))
+        page["status"] = check_ingredients(set(words), index)["status"]
+        return stop_early and page["status"] == "HIGH RISK"
+
+    pages, stopped = document_to_text(data, stop=screen_page)
+    timings = page_timings(pages)
+    result = screen_ocr_text(merge_pages(pages), timings)
+
+    result["ocr_cached"] = False
+    result["timings"] = timings
+    result["pages"] = pages
+    result["page_count"] = len(pages)
+    result["stopped_early"] = stopped
+    return result
+
+def queue_full_response(e):
+    response = jsonify({"error": "OCR queue is full, retry later"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def job_accepted(job_id):
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "poll": url_for("ocr_job", job_id=job_id)
+    }
 
 @app.route("/ocr", methods=["POST"])
 def ocr_image():
     if "image" not in request.files:
         return jsonify({"error": "No image uploaded"}), 400
 
-    image_file = request.files["image"]
-    img = Image.open(image_file)
+    image_bytes = request.files["image"].read()
 
-    extracted_text = pytesseract.image_to_string(img)
-    cleaned_text = clean_ocr_text(extracted_text)
+    if request.values.get("async", "").lower() in ("1", "true", "yes"):
+        try:
+            job_id = ocr_queue.submit(image_bytes)
+        except QueueFull as e:
+            return queue_full_response(e)
+        return jsonify(job_accepted(job_id)), 202
 
-    user_tokens = extract_user_ingredients(cleaned_text)
-    result = check_ingredients(user_tokens)
-    result["extracted_text"] = extracted_text
+    from ocr import DocumentError, is_document
+
+    if is_document(image_bytes):
+        stop_early = request.values.get("stop_early", "").lower() in ("1", "true", "yes")
+        try:
+            result = screen_document(image_bytes, stop_early)
+        except DocumentError as e:
+            return jsonify({"error": str(e)}), 400
+        app.logger.info("ocr timings: %s over %d pages", result["timings"], result["page_count"])
+        return jsonify(result)
+
+    timings = {}
+    extracted_text, cached = extract_text(image_bytes, timings)
+    result = screen_ocr_text(extracted_text, timings)
+
+    result["ocr_cached"] = cached
+    result["timings"] = timings
+    app.logger.info("ocr timings: %s", timings)
 
     return jsonify(result)
 
+@app.route("/ocr/jobs", methods=["GET", "POST"])
+def ocr_jobs():
+    if request.method == "GET":
+        return jsonify(ocr_queue.stats())
+
+    images = [f.read() for f in request.files.getlist("images")]
+    if not images:
+        return jsonify({"error": "No images uploaded"}), 400
+
+    try:
+        job_ids = ocr_queue.submit_many(images)
+    except QueueFull as e:
+        return queue_full_response(e)
+
+    return jsonify({"jobs": [job_accepted(job_id) for job_id in job_ids]}), 202
+
+@app.route("/ocr/jobs/<job_id>")
+def ocr_job(job_id):
+    job = ocr_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+# -------------------------
+# Metrics endpoint
+# -------------------------
+def ratio(hits, total):
+    return hits / float(total) if total else None
+
+metrics.gauge(
+    "rule_cache_lookups_total", "Rule index lookups, served from memory (hit) or after a version check.",
+    lambda: {("hit",): rule_cache.hits, ("check",): rule_cache.checks}, ("result",), kind="counter"
+)
+metrics.gauge("rule_cache_hit_ratio", "Share of rule index lookups served without touching SQLite.",
+              lambda: ratio(rule_cache.hits, rule_cache.hits + rule_cache.checks))
+metrics.gauge("rule_cache_loads_total", "Rule index (re)loads.", lambda: rule_cache.loads, kind="counter")
+metrics.gauge("rule_cache_patches_total", "Reloads that patched only the changed rules.",
+              lambda: rule_cache.patches, kind="counter")
+metrics.gauge("rule_set_rules", "Rules in the loaded index.",
+              lambda: len(rule_cache.index) if rule_cache.index is not None else None)
+metrics.gauge("rule_index_snapshot", "1 when the rule index is served from the mapped snapshot file.",
+              lambda: int(rule_cache.source == "snapshot"))
+metrics.gauge("rule_load_seconds", "Duration of the last rule index load.", lambda: rule_cache.load_seconds)
+metrics.gauge(
+    "verdict_cache_lookups_total", "/check verdict cache lookups by result.",
+    lambda: {("hit",): verdict_cache.hits, ("miss",): verdict_cache.misses}, ("result",), kind="counter"
+)
+metrics.gauge("verdict_cache_hit_ratio", "Share of verdicts served from the verdict cache.",
+              lambda: verdict_cache.stats()["hit_ratio"])
+metrics.gauge("verdict_cache_entries", "Token sets in the verdict cache.", lambda: len(verdict_cache.entries))
+metrics.gauge("ocr_queue_pending", "OCR jobs queued or running.", lambda: ocr_queue.pending)
+metrics.gauge("ocr_queue_capacity", "Maximum pending OCR jobs.", lambda: ocr_queue.max_pending)
+metrics.gauge("ocr_jobs_completed_total", "Finished OCR jobs.", lambda: ocr_queue.completed, kind="counter")
+metrics.gauge("ocr_cache_hit_ratio", "Share of OCR requests answered from the OCR cache.",
+              lambda: ocr_cache.stats()["hit_ratio"])
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # -------------------------
 # Admin login
 # -------------------------
@@ -142,14 +425,12 @@ def admin_login():
         username = request.form.get("username")
         password = request.form.get("password")
 
-        conn = sqlite3.connect(USER_DB)
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT user_id, role FROM users WHERE username=? AND password=?",
-            (username, password)
-        )
-        user = cur.fetchone()
-        conn.close()
+        with users_db.read() as cur:
+            cur.execute(
+                "SELECT user_id, role FROM users WHERE username=? AND password=?",
+                (username, password)
+            )
+            user = cur.fetchone()
 
         if user:
             session["admin_logged_in"] = True
@@ -179,14 +460,11 @@ def admin_register():
             return render_template("admin_register.html", error="Passwords do not match")
 
         try:
-            conn = sqlite3.connect(USER_DB)
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO users (full_name, username, password, registration_number, country, date_of_birth, role)
-                VALUES (?, ?, ?, ?, ?, ?, 'admin')
-            """, (full_name, username, password, reg_no, country, dob))
-            conn.commit()
-            conn.close()
+            with users_db.write() as cur:
+                cur.execute("""
+                    INSERT INTO users (full_name, username, password, registration_number, country, date_of_birth, role)
+                    VALUES (?, ?, ?, ?, ?, ?, 'admin')
+                """, (full_name, username, password, reg_no, country, dob))
         except sqlite3.IntegrityError:
             return render_template("admin_register.html", error="Username already exists")
 
@@ -197,29 +475,119 @@ def admin_register():
 # -------------------------
 # Admin dashboard
 # -------------------------
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(cursor):
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        cursor = None
+    # [sort value, rule_id]; anything else would reach SQLite as a parameter
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        abort(400, "Invalid cursor")
+    value, rule_id = cursor
+    if not isinstance(value, (str, int, float, type(None))) or type(rule_id) is not int:
+        abort(400, "Invalid cursor")
+    return cursor
+
+def rule_filters():
+    # query string -> rules_page keyword arguments
+    sort = request.args.get("sort", "rule_id")
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+
+    return {
+        "risk_level": request.args.get("risk_level") or None,
+        "rule_type": request.args.get("type") or None,
+        "token": (request.args.get("token") or "").strip().lower() or None,
+        "sort": sort if sort in SORT_COLUMNS else "rule_id",
+        "descending": request.args.get("order") == "desc",
+        "after": decode_cursor(request.args.get("after")),
+        "limit": max(1, min(limit, MAX_PAGE_SIZE)),
+    }
+
 @app.route("/admin/dashboard")
 def admin_dashboard():
     if not session.get("admin_logged_in"):
         return redirect(url_for("admin_login"))
 
     role = session.get("role")
+    filters = rule_filters()
 
-    conn = sqlite3.connect(RULES_DB)
-    cur = conn.cursor()
+    with rules_db.read() as cur:
+        rules, next_cursor = rules_page(cur, **filters)
+        pending, next_pending = pending_page(cur, after=request.args.get("pending_after", type=int))
 
-    cur.execute("SELECT rule_id, name, ingredients, risk_level FROM regulatory_rules")
-    rules = cur.fetchall()
+    # keep the filters on the paging links, but not the cursors
+    args = {k: v for k, v in request.args.items() if k not in ("after", "pending_after")}
 
-    cur.execute("SELECT id, rule_id, proposed_name, status FROM pending_changes WHERE status='PENDING'")
-    pending = cur.fetchall()
+    return render_template(
+        "admin_dashboard.html", role=role, rules=rules, pending=pending, args=args,
+        next_cursor=encode_cursor(next_cursor), next_pending=next_pending,
+        review_summary=session.pop("review_summary", None)
+    )
 
-    conn.close()
+@app.route("/admin/search")
+def admin_search():
+    if not session.get("admin_logged_in"):
+        return redirect(url_for("admin_login"))
 
-    return render_template("admin_dashboard.html", role=role, rules=rules, pending=pending)
+    query, rows = run_search()
+    return render_template("admin_search.html", query=query, results=rows)
+
+@app.route("/admin/api/rules")
+def admin_api_rules():
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Login required"}), 401
+
+    with rules_db.read() as cur:
+        rules, next_cursor = rules_page(cur, **rule_filters())
+
+    return jsonify({
+        "rules": [
+            {"rule_id": r[0], "name": r[1], "ingredients": r[2], "risk_level": r[3], "type": r[4]}
+            for r in rules
+        ],
+        "next": encode_cursor(next_cursor),
+    })
+
+@app.route("/admin/db/stats")
+def admin_db_stats():
+    if not session.get("admin_logged_in"):
+        return redirect(url_for("admin_login"))
+
+    return jsonify({"rules": rules_db.stats(), "users": users_db.stats()})
 
 # -------------------------
 # Edit rule
 # -------------------------
+def update_rule(cur, rule_id, name, ingredients, risk):
+    cur.execute("""
+        UPDATE regulatory_rules
+        SET name=?, ingredients=?, risk_level=?
+        WHERE rule_id=?
+    """, (name, ingredients, risk, rule_id))
+    sync_rule_ingredients(cur, [(rule_id, ingredients)])
+    prune_rule_changes(cur)
+
+def rules_changed():
+    # this worker patches its index from the change log right away; the
+    # shared snapshot is recompiled in the background so the other workers
+    # can map the new rule set once it is ready
+    rule_cache.invalidate()
+    rule_cache.get_index()
+    refresh_snapshot_in_background(RULES_DB)
+
 @app.route("/admin/edit/<int:rule_id>", methods=["GET", "POST"])
 def edit_rule(rule_id):
     if not session.get("admin_logged_in"):
@@ -227,59 +595,41 @@ def edit_rule(rule_id):
 
     role = session.get("role")
 
-    conn = sqlite3.connect(RULES_DB)
-    cur = conn.cursor()
-
     if request.method == "POST":
         name = request.form.get("name")
         ingredients = request.form.get("ingredients")
         risk = request.form.get("risk_level")
 
-        cur.execute("SELECT ingredients FROM regulatory_rules WHERE rule_id=?", (rule_id,))
-        old = cur.fetchone()
+        with rules_db.write() as cur:
+            cur.execute("SELECT ingredients FROM regulatory_rules WHERE rule_id=?", (rule_id,))
+            old = cur.fetchone()
 
-        if not old:
-            conn.close()
-            return "Rule not found", 404
+            if not old:
+                return "Rule not found", 404
 
-        old_ing = old[0]
+            old_ing = old[0]
 
-        # category_only -> anyone can update directly
-        if old_ing == "category_only":
-            cur.execute("""
-                UPDATE regulatory_rules
-                SET name=?, ingredients=?, risk_level=?
-                WHERE rule_id=?
-            """, (name, ingredients, risk, rule_id))
-            conn.commit()
-            conn.close()
-            return redirect(url_for("admin_dashboard"))
+            # category_only -> anyone can update directly
+            # real combinations -> superadmin updates directly
+            if old_ing == "category_only" or role == "superadmin":
+                update_rule(cur, rule_id, name, ingredients, risk)
+                applied = True
+            else:
+                # normal admin -> pending
+                cur.execute("""
+                    INSERT INTO pending_changes (rule_id, proposed_name, proposed_ingredients, proposed_risk_level, status)
+                    VALUES (?, ?, ?, ?, 'PENDING')
+                """, (rule_id, name, ingredients, risk))
+                applied = False
 
-        # real combinations
-        if role == "superadmin":
-            # superadmin updates directly
-            cur.execute("""
-                UPDATE regulatory_rules
-                SET name=?, ingredients=?, risk_level=?
-                WHERE rule_id=?
-            """, (name, ingredients, risk, rule_id))
-            conn.commit()
-            conn.close()
-            return redirect(url_for("admin_dashboard"))
-        else:
-            # normal admin -> pending
-            cur.execute("""
-                INSERT INTO pending_changes (rule_id, proposed_name, proposed_ingredients, proposed_risk_level, status)
-                VALUES (?, ?, ?, ?, 'PENDING')
-            """, (rule_id, name, ingredients, risk))
-            conn.commit()
-            conn.close()
-            return redirect(url_for("admin_dashboard"))
+        if applied:
+            rules_changed()
+        return redirect(url_for("admin_dashboard"))
 
     # GET
-    cur.execute("SELECT rule_id, name, ingredients, risk_level FROM regulatory_rules WHERE rule_id=?", (rule_id,))
-    rule = cur.fetchone()
-    conn.close()
+    with rules_db.read() as cur:
+        cur.execute("SELECT rule_id, name, ingredients, risk_level FROM regulatory_rules WHERE rule_id=?", (rule_id,))
+        rule = cur.fetchone()
 
     if not rule:
         return "Rule not found", 404
@@ -294,28 +644,55 @@ def approve_change(change_id):
     if session.get("role") != "superadmin":
         return "Forbidden", 403
 
-    conn = sqlite3.connect(RULES_DB)
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT rule_id, proposed_name, proposed_ingredients, proposed_risk_level
-        FROM pending_changes WHERE id=?
-    """, (change_id,))
-    row = cur.fetchone()
+    # same checks as a bulk review: only a still pending change without a
+    # competing edit for its rule is applied
+    with rules_db.write() as cur:
+        summary = review_pending_changes(cur, [change_id], [])
 
-    if row:
-        rule_id, name, ingredients, risk = row
-
-        cur.execute("""
-            UPDATE regulatory_rules
-            SET name=?, ingredients=?, risk_level=?
-            WHERE rule_id=?
-        """, (name, ingredients, risk, rule_id))
+    if summary["approved"]:
+        rules_changed()
+    session["review_summary"] = {key: len(ids) for key, ids in summary.items()}
+    return redirect(url_for("admin_dashboard"))
 
-        cur.execute("UPDATE pending_changes SET status='APPROVED' WHERE id=?", (change_id,))
-        conn.commit()
+# -------------------------
+# Bulk review (SUPERADMIN)
+# -------------------------
+@app.route("/admin/pending/review", methods=["POST"])
+def review_changes():
+    # JSON {"approve": [ids], "reject": [ids]}, or the dashboard form:
+    # ticked change_id boxes plus action=approve|reject. All decisions go
+    # into one transaction.
+    if session.get("role") != "superadmin":
+        return "Forbidden", 403
 
-    conn.close()
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object with approve and reject lists"}), 400
+        approve, reject = data.get("approve") or [], data.get("reject") or []
+        if not isinstance(approve, list) or not isinstance(reject, list):
+            return jsonify({"error": "approve and reject must be lists of change ids"}), 400
+        if any(type(i) is not int for i in approve + reject):
+            return jsonify({"error": "Change ids must be integers"}), 400
+        invalid = 0
+    else:
+        ids = request.form.getlist("change_id")
+        valid = [int(i) for i in ids if i.isascii() and i.isdigit()]
+        invalid = len(ids) - len(valid)
+        action = request.form.get("action")
+        approve = valid if action == "approve" else []
+        reject = valid if action == "reject" else []
+
+    with rules_db.write() as cur:
+        summary = review_pending_changes(cur, approve, reject)
+
+    if summary["approved"]:
+        rules_changed()
+
+    if request.is_json:
+        return jsonify(summary)
+    session["review_summary"] = {key: len(ids) for key, ids in summary.items()}
+    session["review_summary"]["invalid"] = invalid
     return redirect(url_for("admin_dashboard"))
 
 # -------------------------
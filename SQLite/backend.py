@@ -1,7 +1,16 @@
+import argparse
 import sqlite3
 import re
 import os
 
+from keyword_matcher import KeywordMatcher
+from rule_snapshot import refresh_snapshot
+from rule_store import (
+    bump_rules_version, create_rule_ingredients_table, ensure_rules_schema, ensure_schema,
+    ingredient_rows, mark_derived, mark_rules_reloaded, rebuild_rules_fts, table_exists
+)
+from shards import DEFAULT_JURISDICTION, JURISDICTIONS, shard_db_name
+
 DB_NAME = "rules.db"
 INPUT_FILE = r"C:\Users\hanis\Downloads/banneddrugs.txt"
 
@@ -9,12 +18,10 @@ INPUT_FILE = r"C:\Users\hanis\Downloads/banneddrugs.txt"
 # DATABASE SETUP & CLEAN RESET
 # -------------------------------
 
-def create_database():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS regulatory_rules (
+def create_tables(cursor, suffix=""):
+    # suffix="_staging" builds the shadow tables used by a full reload
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS regulatory_rules{suffix} (
         rule_id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT,
         ingredients TEXT,
@@ -23,29 +30,31 @@ def create_database():
     )
     """)
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS rule_conditions (
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS rule_conditions{suffix} (
         condition_id INTEGER PRIMARY KEY AUTOINCREMENT,
         rule_id INTEGER,
         condition_type TEXT,
         condition_value REAL,
         unit TEXT,
-        FOREIGN KEY(rule_id) REFERENCES regulatory_rules(rule_id)
+        FOREIGN KEY(rule_id) REFERENCES regulatory_rules{suffix}(rule_id)
     )
     """)
 
-    conn.commit()
-    conn.close()
-
 
-def clear_database():
-    conn = sqlite3.connect(DB_NAME)
+def create_database(db_name=DB_NAME):
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM rule_conditions")
-    cursor.execute("DELETE FROM regulatory_rules")
+
+    create_tables(cursor)
+
     conn.commit()
     conn.close()
 
+    # creates the derived tables and backfills any an existing database lacks
+    ensure_schema(db_name)
+
+
 # -------------------------------
 # RULE LINE VALIDATION
 # -------------------------------
@@ -80,23 +89,14 @@ def is_valid_rule_line(line):
 # INPUT INGESTION (TXT)
 # -------------------------------
 
-def load_rules_from_txt(filepath):
-    if not os.path.exists(filepath):
-        print("Input file not found:", filepath)
-        return []
-
+def iter_rules_from_txt(filepath):
     with open(filepath, "r", encoding="cp1252", errors="ignore") as f:
-        lines = f.readlines()
-
-    rules = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if is_valid_rule_line(line):
-            rules.append(line)
-
-    return rules
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if is_valid_rule_line(line):
+                yield line
 
 
 # -------------------------------
@@ -155,19 +155,21 @@ CATEGORY_KEYWORDS = [
     "penicillin", "sulphonamide"
 ]
 
+# molecules must start a word ("cetirizine" is not in "levocetirizine"),
+# category stems may sit inside one ("corticosteroids" -> steroid)
+INGREDIENT_MATCHER = KeywordMatcher(KNOWN_INGREDIENTS)
+CATEGORY_MATCHER = KeywordMatcher(CATEGORY_KEYWORDS, word_start=False)
+
 def extract_ingredients(text):
     t = text.lower()
     tokens = set()
 
     # 1. Exact known molecules (highest confidence)
-    for ing in KNOWN_INGREDIENTS:
-        if ing in t:
-            tokens.add(ing)
+    tokens.update(INGREDIENT_MATCHER.find(t))
 
     # 2. Category keywords
-    for cat in CATEGORY_KEYWORDS:
-        if cat in t:
-            tokens.add(cat.rstrip("s"))
+    for cat in CATEGORY_MATCHER.find(t):
+        tokens.add(cat.rstrip("s"))
 
     # 3. Explicit FDC using '+'
     if "+" in t:
@@ -224,51 +226,165 @@ def extract_condition(text):
 # CORE PIPELINE
 # -------------------------------
 
-def process_rule(raw_text):
+def build_rule(raw_text):
     rule_type = detect_type(raw_text)
     risk = assign_risk(rule_type)
     ingredients = extract_ingredients(raw_text)
 
     name = raw_text[:100] + "..." if len(raw_text) > 100 else raw_text
 
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        INSERT INTO regulatory_rules (name, ingredients, risk_level, type)
-        VALUES (?, ?, ?, ?)
-    """, (name, ingredients, risk, rule_type))
-
-    rule_id = cursor.lastrowid
-
+    condition = None
     if rule_type == "CONDITIONAL":
         ctype, val, unit = extract_condition(raw_text)
         if ctype:
-            cursor.execute("""
-                INSERT INTO rule_conditions (rule_id, condition_type, condition_value, unit)
-                VALUES (?, ?, ?, ?)
-            """, (rule_id, ctype, val, unit))
+            condition = (ctype, val, unit)
 
-    conn.commit()
-    conn.close()
+    return (name, ingredients, risk, rule_type), condition
+
+
+# -------------------------------
+# BULK RELOAD
+# -------------------------------
+
+BATCH_SIZE = 5000
+
+
+def iter_batches(raw_rules, batch_size=BATCH_SIZE):
+    batch = []
+    for raw_text in raw_rules:
+        batch.append(raw_text)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def last_rule_id(cursor):
+    # highest rule id the live table ever handed out; AUTOINCREMENT keeps it
+    # in sqlite_sequence even after the row itself was deleted
+    last = 0
+    if table_exists(cursor, "sqlite_sequence"):
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'regulatory_rules'")
+        row = cursor.fetchone()
+        last = row[0] if row else 0
+    if table_exists(cursor, "regulatory_rules"):
+        cursor.execute("SELECT MAX(rule_id) FROM regulatory_rules")
+        last = max(last, cursor.fetchone()[0] or 0)
+    return last
+
+
+def load_staging(cursor, raw_rules, batch_size=BATCH_SIZE):
+    cursor.execute("DROP TABLE IF EXISTS rule_conditions_staging")
+    cursor.execute("DROP TABLE IF EXISTS regulatory_rules_staging")
+    cursor.execute("DROP TABLE IF EXISTS rule_ingredients_staging")
+    create_tables(cursor, "_staging")
+
+    # indexed after the swap, index names do not follow a table rename
+    create_rule_ingredients_table(cursor, "rule_ingredients_staging")
+
+    # rule ids are assigned here so conditions can be batched as well. They
+    # continue after the current table's ids, as the old DELETE-and-insert
+    # reload did, so pending_changes rows for replaced rules never end up
+    # pointing at unrelated new ones
+    first_id = last_rule_id(cursor)
+    rule_id = first_id
+    for batch in iter_batches(raw_rules, batch_size):
+        rules = []
+        conditions = []
+        for raw_text in batch:
+            rule_id += 1
+            row, condition = build_rule(raw_text)
+            rules.append((rule_id, *row))
+            if condition:
+                conditions.append((rule_id, *condition))
+
+        cursor.executemany("""
+            INSERT INTO regulatory_rules_staging (rule_id, name, ingredients, risk_level, type)
+            VALUES (?, ?, ?, ?, ?)
+        """, rules)
+        cursor.executemany("""
+            INSERT INTO rule_conditions_staging (rule_id, condition_type, condition_value, unit)
+            VALUES (?, ?, ?, ?)
+        """, conditions)
+        cursor.executemany("""
+            INSERT INTO rule_ingredients_staging (rule_id, token)
+            VALUES (?, ?)
+        """, ingredient_rows((r[0], r[2]) for r in rules))
+
+    return rule_id - first_id
+
+
+def swap_in_staging(cursor):
+    # readers see either the old rule set or the new one, never an empty table
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("DROP TABLE IF EXISTS rule_conditions")
+    cursor.execute("DROP TABLE IF EXISTS regulatory_rules")
+    cursor.execute("DROP TABLE IF EXISTS rule_ingredients")
+    cursor.execute("ALTER TABLE regulatory_rules_staging RENAME TO regulatory_rules")
+    cursor.execute("ALTER TABLE rule_conditions_staging RENAME TO rule_conditions")
+    cursor.execute("ALTER TABLE rule_ingredients_staging RENAME TO rule_ingredients")
+
+    # the version triggers and indexes went away with the old tables, and
+    # rules_fts still indexes the old rows
+    ensure_rules_schema(cursor)
+    mark_derived(cursor, "rule_ingredients")
+    rebuild_rules_fts(cursor)
+    mark_rules_reloaded(cursor)
+    bump_rules_version(cursor)
+    cursor.execute("COMMIT")
+
+
+def reload_rules(raw_rules, db_name=DB_NAME):
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+
+    # bulk-load settings: the staging tables are rebuilt from scratch on
+    # failure, so they do not need crash durability
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = OFF")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.execute("PRAGMA cache_size = -65536")
+
+    try:
+        cursor.execute("BEGIN")
+        count = load_staging(cursor, raw_rules)
+        cursor.execute("COMMIT")
+
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        swap_in_staging(cursor)
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    return count
 
 # -------------------------------
 # MAIN
 # -------------------------------
 
-def main():
+def main(input_file=INPUT_FILE, db_name=DB_NAME):
     print("Initializing backend...")
-    create_database()
-    clear_database()
-
-    rules = load_rules_from_txt(INPUT_FILE)
+    create_database(db_name)
 
-    print(f"Valid rules loaded: {len(rules)}")
+    if not os.path.exists(input_file):
+        print("Input file not found:", input_file)
+        return
 
-    for rule in rules:
-        process_rule(rule)
+    count = reload_rules(iter_rules_from_txt(input_file), db_name)
+    refresh_snapshot(db_name)
 
+    print(f"Valid rules loaded: {count}")
     print("Database populated successfully.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Load a banned-drug list into a rules database.")
+    parser.add_argument("--jurisdiction", default=DEFAULT_JURISDICTION, choices=sorted(JURISDICTIONS),
+                        help="country whose list this is; each one gets its own rules shard")
+    parser.add_argument("--input", default=INPUT_FILE, help="rule list, one rule per line")
+    args = parser.parse_args()
+
+    main(args.input, shard_db_name(args.jurisdiction))
@@ -0,0 +1,85 @@
+# -------------------------
+# Vectorized batch matching
+# -------------------------
+# Screening many products at once with NumPy: every (product, token) pair
+# contributes that token's posting array, tagged with the product number.
+# One np.unique over the tagged keys then gives the hit count of every
+# (product, rule) pair, and comparing it with the rule's required count
+# splits exact from related matches for the whole batch.
+#
+# NumPy is optional. Without it, for small batches where the setup costs
+# more than it saves, or for an index without batch tables (one patched
+# from the change log), each input goes through index.match().
+MIN_VECTOR_BATCH = 32
+
+_numpy = None
+
+def load_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class BatchTables:
+    # Per-index arrays for match_many, built by the index on first use.
+    #   lookup(token) -> array of rule keys, or None
+    #   required[key] -> tokens the rule needs
+    #   names[key]    -> rule name (object array)
+
+    def __init__(self, lookup, required, names):
+        self.lookup = lookup
+        self.required = required
+        self.names = names
+        self.stride = len(required)
+
+
+def match_many(index, token_sets):
+    # [(exact_names, related_names), ...], same as index.match() per input
+    token_sets = list(token_sets)
+    np = load_numpy()
+    if np is None or len(token_sets) < MIN_VECTOR_BATCH or not hasattr(index, "batch_tables"):
+        return [index.match(tokens) for tokens in token_sets]
+
+    tables = index.batch_tables(np)
+    n = len(token_sets)
+
+    parts, owners, lengths = [], [], []
+    for i, tokens in enumerate(token_sets):
+        for tok in tokens:
+            keys = tables.lookup(tok)
+            if keys is not None and len(keys):
+                parts.append(keys)
+                owners.append(i)
+                lengths.append(len(keys))
+
+    if not parts:
+        return [([], []) for _ in range(n)]
+
+    keys = np.concatenate(parts).astype(np.int64, copy=False)
+    keys += np.repeat(np.array(owners, dtype=np.int64) * tables.stride, lengths)
+
+    # sorted by (input, rule key), i.e. rule_id order within each input
+    pairs, hits = np.unique(keys, return_counts=True)
+    inputs, rules = np.divmod(pairs, tables.stride)
+    exact = hits == tables.required[rules]
+
+    # exact before related within each input; lexsort is stable, so both
+    # halves keep their rule order
+    order = np.lexsort((~exact, inputs))
+    names = tables.names[rules[order]].tolist()
+    n_exact = np.bincount(inputs[exact], minlength=n).tolist()
+    n_total = np.bincount(inputs, minlength=n).tolist()
+
+    results = []
+    pos = 0
+    for i in range(n):
+        split = pos + n_exact[i]
+        end = pos + n_total[i]
+        results.append((names[pos:split], names[split:end]))
+        pos = end
+    return results
@@ -0,0 +1,370 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import backend
+import repair_ingredients
+from batch_match import load_numpy, match_many
+from matcher import RuleIndex, build_verdict, clean_ocr_text, extract_user_ingredients
+from rule_snapshot import RuleSnapshot, build_snapshot
+
+# -------------------------
+# Synthetic data
+# -------------------------
+# Rule lines look like the gazette text backend.py ingests ("12. A + B",
+# "Fixed dose combination of A with B", single substances), built from the
+# real ingredient dictionary plus made-up molecule names so the vocabulary
+# grows with the rule set the way a real one does.
+SYLLABLES = ["lo", "xa", "ce", "ti", "ri", "zi", "ne", "pro", "mi", "do", "fen", "zol", "ami", "cil", "tra", "ve"]
+SUFFIXES = ["ine", "ole", "azole", "amide", "icin", "oxacin", "olol", "pril", "statin", "mab"]
+SALTS = ["hydrochloride", "sodium", "maleate", "citrate", "sulphate"]
+FILLER = ["tablets", "ip", "each", "film", "coated", "tablet", "contains", "mg", "excipients", "q.s"]
+
+def molecule_names(rng, count):
+    names = set(backend.KNOWN_INGREDIENTS)
+    while len(names) < count:
+        stem = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+        names.add(stem + rng.choice(SUFFIXES))
+    return sorted(names)
+
+def rule_lines(rng, size, vocabulary):
+    lines = []
+    for i in range(1, size + 1):
+        shape = rng.random()
+        if shape < 0.6:
+            parts = rng.sample(vocabulary, rng.randint(2, 4))
+            text = " + ".join(p.capitalize() for p in parts)
+        elif shape < 0.8:
+            a, b = rng.sample(vocabulary, 2)
+            text = f"Fixed dose combination of {a.capitalize()} with {b.capitalize()}"
+        elif shape < 0.9:
+            text = f"{rng.choice(vocabulary).capitalize()} for human use"
+        else:
+            category = rng.choice(sorted(backend.CATEGORY_KEYWORDS))
+            text = f"Fixed dose combinations of {category} drugs for paediatric use"
+        lines.append(f"{i}. {text}")
+    return lines
+
+def ingredient_lists(rng, count, vocabulary):
+    texts = []
+    for _ in range(count):
+        words = []
+        for name in rng.sample(vocabulary, rng.randint(1, 5)):
+            words.append(f"{name.capitalize()} {rng.choice(SALTS)} {rng.randint(5, 500)} mg")
+        words += rng.sample(FILLER, 3)
+        rng.shuffle(words)
+        texts.append(", ".join(words))
+    return texts
+
+def ocr_noise(rng, text):
+    # the kind of damage clean_ocr_text has to undo
+    swaps = {"l": "1", "o": "0", "i": "|", "s": "5"}
+    out = []
+    for ch in text:
+        if ch in swaps and rng.random() < 0.05:
+            ch = swaps[ch]
+        out.append(ch)
+        if rng.random() < 0.02:
+            out.append(rng.choice("~*^'`"))
+    return "".join(out) + "\n\n  Mfg. Lic. No. KD-" + str(rng.randint(100, 999))
+
+def label_image(text, size=(2400, 1800)):
+    # a JPEG "photo" of a label: dark text on a light background
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", size, (238, 236, 228))
+    draw = ImageDraw.Draw(img)
+    y = 80
+    for line in [text[i:i + 60] for i in range(0, len(text), 60)]:
+        draw.text((80, y), line, fill=(20, 20, 20))
+        y += 40
+
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90, dpi=(600, 600))
+    return buf.getvalue()
+
+def rule_rows(lines):
+    # (rule_id, name, ingredients) rows as backend.py would store them
+    rows = []
+    for rule_id, line in enumerate(lines, 1):
+        (name, ingredients, _, _), _ = backend.build_rule(line)
+        rows.append((rule_id, name, ingredients))
+    return rows
+
+# -------------------------
+# Measurement
+# -------------------------
+def percentile(sorted_times, p):
+    # nearest-rank percentile
+    k = max(0, min(len(sorted_times) - 1, int(round(p / 100.0 * len(sorted_times))) - 1))
+    return sorted_times[k]
+
+def summarize(times, items=None):
+    times = sorted(times)
+    total = sum(times)
+    result = {
+        "runs": len(times),
+        "p50_ms": round(percentile(times, 50) * 1000, 4),
+        "p95_ms": round(percentile(times, 95) * 1000, 4),
+        "p99_ms": round(percentile(times, 99) * 1000, 4),
+        "total_seconds": round(total, 4),
+    }
+    if total:
+        result["per_second"] = round((items or len(times)) / total, 1)
+    return result
+
+def time_calls(func, inputs):
+    times = []
+    for arg in inputs:
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    return times
+
+def time_repeated(func, repeat, items):
+    # whole-job benchmarks (ingest, repair) run a few times over the same input
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return summarize(times, items * repeat)
+
+# -------------------------
+# Benchmarks
+# -------------------------
+def bench_text(rng, args, vocabulary):
+    texts = ingredient_lists(rng, args.iterations, vocabulary)
+    noisy = [ocr_noise(rng, t) for t in texts]
+    return {
+        "extract_user_ingredients": summarize(time_calls(extract_user_ingredients, texts)),
+        "clean_ocr_text": summarize(time_calls(clean_ocr_text, noisy)),
+    }
+
+def bench_rules(rng, args, size, vocabulary, workdir):
+    lines = rule_lines(rng, size, vocabulary)
+    results = {}
+
+    rows = rule_rows(lines)
+    index = RuleIndex(rows)
+    results["build_rules"] = time_repeated(lambda: rule_rows(lines), args.repeat, size)
+    results["index_build"] = time_repeated(lambda: RuleIndex(rows), args.repeat, size)
+
+    # screen inputs that hit real rules as well as misses
+    texts = ingredient_lists(rng, args.iterations, vocabulary)
+    token_sets = [extract_user_ingredients(t) for t in texts]
+    results["check_ingredients"] = summarize(
+        time_calls(lambda tokens: build_verdict(*index.match(tokens)), token_sets)
+    )
+
+    # the whole input set as one batch, as /check/batch and
+    # screen_catalogue.py do it (vectorized when NumPy is installed)
+    results["match_many"] = time_repeated(lambda: match_many(index, token_sets), args.repeat, len(token_sets))
+    results["match_many"]["numpy"] = load_numpy() is not None
+
+    # ingestion and repair run against a scratch database
+    db_path = os.path.join(workdir, f"rules_{size}.db")
+    results["ingest"] = time_repeated(lambda: backend.reload_rules(iter(lines), db_name=db_path), args.repeat, size)
+
+    snapshot = os.path.join(workdir, f"rules_{size}.snapshot")
+    results["snapshot_build"] = time_repeated(lambda: build_snapshot(db_path, snapshot), args.repeat, size)
+    results["snapshot_load"] = time_repeated(lambda: RuleSnapshot(snapshot), args.repeat, size)
+    mapped = RuleSnapshot(snapshot)
+    results["check_ingredients_snapshot"] = summarize(
+        time_calls(lambda tokens: build_verdict(*mapped.match(tokens)), token_sets)
+    )
+
+    results["repair_full"] = time_repeated(lambda: repair_ingredients.repair_database(full=True, db_name=db_path), args.repeat, size)
+    results["repair_noop"] = time_repeated(lambda: repair_ingredients.repair_database(db_name=db_path), args.repeat, size)
+
+    return results
+
+def tesseract_available():
+    try:
+        import ocr
+        ocr.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def bench_ocr(rng, args, vocabulary):
+    try:
+        from PIL import Image
+    except ImportError:
+        return {"skipped": "Pillow is not installed"}
+
+    from ocr_preprocess import draft, preprocess
+
+    images = [label_image(t) for t in ingredient_lists(rng, args.images, vocabulary)]
+
+    def prepare(image_bytes):
+        img = draft(Image.open(io.BytesIO(image_bytes)))
+        img.load()
+        return preprocess(img)
+
+    results = {"preprocess": summarize(time_calls(prepare, images))}
+
+    if tesseract_available():
+        from ocr import image_to_text
+        results["image_to_text"] = summarize(time_calls(image_to_text, images))
+    else:
+        results["image_to_text"] = {"skipped": "tesseract is not available"}
+
+    # recognition alone per backend, after one warm-up image so the
+    # persistent engines have their model loaded
+    pages = [prepare(image_bytes) for image_bytes in images]
+    for name in ("pytesseract", "tesserocr"):
+        results[f"ocr_warm_{name}"] = bench_ocr_backend(name, pages)
+    return results
+
+def bench_ocr_backend(name, pages):
+    import ocr
+
+    backend = ocr.load_backend(name)
+    if backend.name != name:
+        return {"skipped": f"{name} is not installed"}
+    try:
+        backend.image_to_string(pages[0])
+    except Exception as e:
+        return {"skipped": f"{name} is not usable: {e}"}
+    return summarize(time_calls(backend.image_to_string, pages))
+
+COLD_START_MODULES = ["matcher", "app"]
+OCR_MODULES = ["PIL.Image", "pytesseract"]
+
+COLD_START_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "ocr_loaded": [m for m in {ocr_modules!r} if m in sys.modules],
+}}))
+"""
+
+def bench_cold_start(args):
+    # a fresh interpreter per run, like a newly started web worker
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in COLD_START_MODULES:
+        script = COLD_START_SCRIPT.format(module=module, ocr_modules=OCR_MODULES)
+        imports, walls, loaded = [], [], []
+        for _ in range(args.cold_starts):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=here)
+            walls.append(time.perf_counter() - start)
+            if out.returncode != 0:
+                results[f"import_{module}"] = {"skipped": out.stderr.strip().splitlines()[-1]}
+                break
+            info = json.loads(out.stdout.strip().splitlines()[-1])
+            imports.append(info["seconds"])
+            loaded = info["ocr_loaded"]
+        else:
+            results[f"import_{module}"] = dict(summarize(imports), ocr_modules_loaded=loaded)
+            results[f"process_{module}"] = summarize(walls)
+    return results
+
+# -------------------------
+# Report
+# -------------------------
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "p50_ms" not in value and "skipped" not in value:
+            yield from flatten(value, name + "/")
+        else:
+            yield name, value
+
+def print_report(report, baseline=None):
+    old = dict(flatten(baseline["results"])) if baseline else {}
+    for name, value in flatten(report["results"]):
+        if "skipped" in value:
+            print(f"{name:45s} skipped: {value['skipped']}")
+            continue
+
+        line = f"{name:45s} p50 {value['p50_ms']:10.3f} ms  p95 {value['p95_ms']:10.3f} ms  p99 {value['p99_ms']:10.3f} ms"
+        if value.get("per_second"):
+            line += f"  {value['per_second']:12.1f}/s"
+        before = old.get(name)
+        if before and before.get("p50_ms"):
+            line += f"  x{value['p50_ms'] / before['p50_ms']:.2f} vs {baseline.get('commit')}"
+        print(line)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark screening, OCR, ingestion and repair.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated rule set sizes")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per latency benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per ingestion/repair benchmark")
+    parser.add_argument("--images", type=int, default=10, help="synthetic label images for OCR")
+    parser.add_argument("--cold-starts", type=int, default=5, help="fresh interpreters per import benchmark")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-ocr", action="store_true")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="where to save the JSON report")
+    parser.add_argument("--compare", help="earlier JSON report to compare p50 latencies against")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "sizes": sizes, "iterations": args.iterations, "repeat": args.repeat,
+            "images": args.images, "cold_starts": args.cold_starts, "seed": args.seed,
+        },
+        "results": {},
+    }
+
+    report["results"]["cold_start"] = bench_cold_start(args)
+
+    vocabulary = molecule_names(rng, 400)
+    report["results"]["text"] = bench_text(rng, args, vocabulary)
+
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for size in sizes:
+            # bigger rule sets also have a bigger vocabulary
+            vocab = molecule_names(rng, max(400, size // 10))
+            report["results"][f"rules_{size}"] = bench_rules(rng, args, size, vocab, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if not args.skip_ocr:
+        report["results"]["ocr"] = bench_ocr(rng, args, vocabulary)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args.output}")
+
+if __name__ == "__main__":
+    main()
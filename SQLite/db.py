@@ -0,0 +1,145 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# -------------------------
+# Connection settings
+# -------------------------
+# WAL lets screening reads carry on while an admin write or a backend.py
+# reload is in progress; NORMAL sync is safe in WAL mode and skips an fsync
+# per commit.
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16384",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+BUSY_TIMEOUT = 5.0
+CACHED_STATEMENTS = 256
+
+# -------------------------
+# Connection pool
+# -------------------------
+# Flask's development server (and most WSGI servers) may run every request
+# on a new thread, so connections are checked out per request from a shared
+# set instead of belonging to a thread. That keeps each connection, with its
+# PRAGMAs and prepared statement cache, alive across requests.
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+
+
+class ConnectionPool:
+    # At most `size` long-lived connections, opened on demand; a caller that
+    # finds them all in use waits for one to come back. sqlite3 keeps a
+    # prepared statement cache on each connection, so repeated queries skip
+    # re-parsing. Connections are never reused across a fork.
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+        self.opened = 0
+        self.open_connections = 0
+        self.checkout_waits = 0
+        self.write_transactions = 0
+        self.lock_waits = 0
+        self.lock_wait_seconds = 0.0
+        self.max_lock_wait_seconds = 0.0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _checkout(self):
+        if os.getpid() != self.pid:
+            # forked worker: start from a clean slate
+            with self.lock:
+                self.pid = os.getpid()
+                self.idle = queue.LifoQueue()
+                self.open_connections = 0
+
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            can_open = self.open_connections < self.size
+            if can_open:
+                self.open_connections += 1
+                self.opened += 1
+            else:
+                self.checkout_waits += 1
+
+        if not can_open:
+            return self.idle.get()
+
+        try:
+            return self._open()
+        except BaseException:
+            with self.lock:
+                self.open_connections -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put(conn)
+
+    @contextmanager
+    def read(self):
+        with self.connection() as conn:
+            yield conn.cursor()
+
+    @contextmanager
+    def write(self):
+        with self.connection() as conn:
+            cur = conn.cursor()
+
+            # take the write lock up front so the wait is measured in one place
+            start = time.perf_counter()
+            cur.execute("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - start
+
+            with self.lock:
+                self.write_transactions += 1
+                self.lock_wait_seconds += waited
+                self.max_lock_wait_seconds = max(self.max_lock_wait_seconds, waited)
+                if waited > 0.001:
+                    self.lock_waits += 1
+
+            try:
+                yield cur
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def stats(self):
+        return {
+            "path": os.path.basename(self.path),
+            "open_connections": self.open_connections,
+            "opened": self.opened,
+            "idle_connections": self.idle.qsize(),
+            "checkout_waits": self.checkout_waits,
+            "write_transactions": self.write_transactions,
+            "lock_waits": self.lock_waits,
+            "lock_wait_seconds": round(self.lock_wait_seconds, 4),
+            "max_lock_wait_seconds": round(self.max_lock_wait_seconds, 4),
+        }
@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+# -------------------------
+# Approximate token matching
+# -------------------------
+MIN_FUZZY_LENGTH = 5
+MIN_FUZZY_SCORE = 0.8
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def max_distance(word):
+    return 1 if len(word) <= 7 else 2
+
+def bounded_levenshtein(a, b, limit):
+    # edit distance, or limit + 1 as soon as it is certain to exceed limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            cost = previous[j - 1] + (ca != cb)
+            cost = min(cost, previous[j] + 1, current[j - 1] + 1)
+            current.append(cost)
+            best = min(best, cost)
+        if best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    # Trigram index over the rule vocabulary. Candidates must share enough
+    # trigrams with the noisy word to be within the edit-distance bound, and
+    # only those few are checked with a bounded Levenshtein.
+
+    def __init__(self, vocabulary):
+        self.vocabulary = {t for t in vocabulary if len(t) >= MIN_FUZZY_LENGTH}
+        self.grams = defaultdict(list)
+        for token in self.vocabulary:
+            for g in trigrams(token):
+                self.grams[g].append(token)
+
+    def lookup(self, word):
+        # best (token, score) for a word that is not itself in the
+        # vocabulary, or None
+        if len(word) < MIN_FUZZY_LENGTH or word in self.vocabulary:
+            return None
+
+        limit = max_distance(word)
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        for g in grams:
+            for token in self.grams.get(g, ()):
+                shared[token] += 1
+
+        # each edit destroys at most three trigrams
+        needed = len(grams) - 3 * limit
+
+        best = None
+        for token, count in shared.items():
+            if count < needed:
+                continue
+            dist = bounded_levenshtein(word, token, limit)
+            if dist > limit:
+                continue
+            score = 1.0 - dist / float(max(len(word), len(token)))
+            if score >= MIN_FUZZY_SCORE and (best is None or score > best[1]):
+                best = (token, round(score, 3))
+        return best
+
+    def match_words(self, words):
+        # words in reading order; adjacent pairs are also tried joined,
+        # because OCR often splits a name where it drops a letter
+        # ("nimesu1ide" -> "nimesu ide")
+        candidates = list(words)
+        candidates += [
+            a + b for a, b in zip(words, words[1:])
+            if a not in self.vocabulary or b not in self.vocabulary
+        ]
+
+        hits = []
+        seen = set()
+        for word in candidates:
+            if word in seen:
+                continue
+            seen.add(word)
+            best = self.lookup(word)
+            if best:
+                hits.append({"input": word, "token": best[0], "score": best[1]})
+        return hits
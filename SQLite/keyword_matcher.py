@@ -0,0 +1,60 @@
+import re
+
+# -------------------------
+# Multi-pattern keyword matcher
+# -------------------------
+def _trie_pattern(words):
+    # Fold the dictionary into a prefix trie and emit it as one regex, so
+    # each text position costs at most one walk down the trie instead of one
+    # test per keyword.
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    # Finds every dictionary keyword in a text in one pass.
+    #
+    # With word_start=True a keyword only counts when it begins a word, so
+    # "cetirizine" is not reported inside "levocetirizine". Keywords may still
+    # run into a longer word ("vitamin" in "vitamins").
+
+    def __init__(self, keywords, word_start=True):
+        self.keywords = sorted({k.lower() for k in keywords if k})
+
+        # the regex reports the longest keyword at each position; shorter
+        # keywords that are prefixes of it are hits as well
+        self.prefixes = {
+            k: [p for p in self.keywords if k.startswith(p)]
+            for k in self.keywords
+        }
+
+        start = r"(?<![a-z])" if word_start else ""
+        if self.keywords:
+            self.regex = re.compile(start + "(?=(" + _trie_pattern(self.keywords) + "))")
+        else:
+            self.regex = None
+
+    def find(self, text):
+        found = set()
+        if self.regex is None:
+            return found
+
+        for m in self.regex.finditer(text):
+            found.update(self.prefixes[m.group(1)])
+        return found
@@ -0,0 +1,237 @@
+import heapq
+import re
+from collections import Counter, defaultdict
+
+from batch_match import BatchTables
+from fuzzy import FuzzyIndex
+
+# -------------------------
+# Helper data
+# -------------------------
+SALT_MAP = {
+    "hydrochloride", "hcl",
+    "sodium", "potassium", "calcium", "magnesium",
+    "phosphate", "sulphate", "sulfate",
+    "nitrate", "acetate"
+}
+
+# -------------------------
+# Text helpers
+# -------------------------
+def extract_user_words(text):
+    text = text.lower()
+    words = re.findall(r"[a-z\-]{3,}", text)
+    return [w for w in words if w not in SALT_MAP]
+
+def extract_user_ingredients(text):
+    return set(extract_user_words(text))
+
+def clean_ocr_text(text):
+    text = text.lower()
+    text = re.sub(r"\d+(mg|ml|mcg)", " ", text)
+    text = re.sub(r"[^a-z\s\-]", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+# -------------------------
+# Rule parsing
+# -------------------------
+def parse_rule_tokens(ing_text):
+    if not ing_text or ing_text == "category_only":
+        return set()
+
+    return {
+        t.strip()
+        for t in ing_text.split(",")
+        if t.strip() and t.strip() not in SALT_MAP
+    }
+
+# -------------------------
+# Inverted index
+# -------------------------
+class RuleIndex:
+    # token -> [rule_id, ...] plus the number of distinct tokens each rule
+    # needs. A rule is an exact match when every one of its tokens is hit,
+    # and related when at least one is.
+
+    def __init__(self, rules=()):
+        self.postings = defaultdict(list)
+        self.required = {}
+        self.names = {}
+        self._fuzzy = None
+        self._batch = None
+
+        for rule_id, name, ing_text in rules:
+            self.add_rule(rule_id, name, ing_text)
+
+    def __len__(self):
+        return len(self.required)
+
+    def __contains__(self, rule_id):
+        return rule_id in self.required
+
+    def add_rule(self, rule_id, name, ing_text):
+        tokens = parse_rule_tokens(ing_text)
+
+        # rules without tokens can never match, keep them out of the index
+        if not tokens:
+            return
+
+        self.names[rule_id] = name
+        self.required[rule_id] = len(tokens)
+        for tok in tokens:
+            self.postings[tok].append(rule_id)
+        self._batch = None
+
+    def _hits(self, user_tokens):
+        # Counter.update counts a whole posting list in C, which matters
+        # when a pasted leaflet brings hundreds of tokens
+        hits = Counter()
+        for tok in user_tokens:
+            rule_ids = self.postings.get(tok)
+            if rule_ids:
+                hits.update(rule_ids)
+        return hits
+
+    def match_rules(self, user_tokens):
+        # [(rule_id, name, exact), ...] in rule_id order
+        hits = self._hits(user_tokens)
+        return [(rule_id, self.names[rule_id], hits[rule_id] == self.required[rule_id]) for rule_id in sorted(hits)]
+
+    def match(self, user_tokens):
+        hits = self._hits(user_tokens)
+
+        exact = []
+        related = []
+
+        # keep the table order the full scan used to report in
+        for rule_id in sorted(hits):
+            if hits[rule_id] == self.required[rule_id]:
+                exact.append(self.names[rule_id])
+            else:
+                related.append(self.names[rule_id])
+
+        return exact, related
+
+    def tokens(self):
+        return list(self.postings)
+
+    def fuzzy(self):
+        # built on first use, it lives and dies with this rule set
+        if self._fuzzy is None:
+            self._fuzzy = FuzzyIndex(self.postings)
+        return self._fuzzy
+
+    def batch_tables(self, np):
+        # NumPy copies of the index for batch_match.match_many, keyed by
+        # rule_id
+        if self._batch is None:
+            stride = max(self.required, default=0) + 1
+            required = np.zeros(stride, dtype=np.int64)
+            names = np.empty(stride, dtype=object)
+            for rule_id, count in self.required.items():
+                required[rule_id] = count
+                names[rule_id] = self.names[rule_id]
+            postings = {tok: np.array(ids, dtype=np.int64) for tok, ids in self.postings.items()}
+            self._batch = BatchTables(postings.get, required, names)
+        return self._batch
+
+class PatchedIndex:
+    # A loaded index (RuleIndex or RuleSnapshot) with some rules replaced.
+    # changed holds every rule_id edited since the base was loaded; rows
+    # are their current versions, indexed in a small RuleIndex overlay.
+    # Matches from the base skip changed rules and are merged with the
+    # overlay's in rule_id order. No batch tables: match_many loops.
+
+    def __init__(self, base, changed, rows):
+        self.base = base
+        self.changed = frozenset(changed)
+        self.rows = rows
+        self.overlay = RuleIndex(rows)
+        self._fuzzy = None
+        self._dropped = sum(1 for rule_id in self.changed if rule_id in base)
+
+    def __len__(self):
+        return len(self.base) - self._dropped + len(self.overlay)
+
+    def __contains__(self, rule_id):
+        if rule_id in self.changed:
+            return rule_id in self.overlay
+        return rule_id in self.base
+
+    def match_rules(self, user_tokens):
+        changed = self.changed
+        base = [m for m in self.base.match_rules(user_tokens) if m[0] not in changed]
+        return list(heapq.merge(base, self.overlay.match_rules(user_tokens)))
+
+    def match(self, user_tokens):
+        exact = []
+        related = []
+        for _, name, is_exact in self.match_rules(user_tokens):
+            (exact if is_exact else related).append(name)
+        return exact, related
+
+    def tokens(self):
+        # may keep tokens only removed rules had; they just never match
+        return list(set(self.base.tokens()).union(self.overlay.postings))
+
+    def fuzzy(self):
+        if self._fuzzy is None:
+            self._fuzzy = FuzzyIndex(self.tokens())
+        return self._fuzzy
+
+def patch_index(index, rule_ids, rows):
+    # new index with rule_ids replaced by rows, their current
+    # (rule_id, name, ingredients); rules missing from rows were deleted.
+    # The old index is left alone, requests holding it keep working.
+    rule_ids = set(rule_ids)
+    if isinstance(index, PatchedIndex):
+        kept = [row for row in index.rows if row[0] not in rule_ids]
+        return PatchedIndex(index.base, index.changed | rule_ids, sorted(kept + list(rows)))
+    return PatchedIndex(index, rule_ids, sorted(rows))
+
+# -------------------------
+# Verdict
+# -------------------------
+def build_verdict(exact_matches, related_matches, authority="CDSCO"):
+    if exact_matches:
+        exact_names = set(exact_matches)
+        return {
+            "status": "HIGH RISK",
+            "message": "Exact harmful combination detected.",
+            "exact_matches": exact_matches,
+            "related_matches": [r for r in related_matches if r not in exact_names]
+        }
+
+    if related_matches:
+        return {
+            "status": "NEEDS REVIEW",
+            "message": "Category-level regulatory match found.",
+            "exact_matches": [],
+            "related_matches": related_matches
+        }
+
+    return {
+        "status": "NO MATCH",
+        "message": f"No {authority} regulatory issues detected.",
+        "exact_matches": [],
+        "related_matches": []
+    }
+
+def add_fuzzy_matches(result, words, index):
+    # Rules reachable only through approximately spelled tokens are listed
+    # apart from the exact/related ones so reviewers can tell them apart.
+    hits = index.fuzzy().match_words(words)
+    result["fuzzy_matches"] = hits
+    result["fuzzy_rule_matches"] = []
+    if not hits:
+        return result
+
+    already = set(result["exact_matches"]) | set(result["related_matches"])
+    exact, related = index.match(set(words) | {h["token"] for h in hits})
+    result["fuzzy_rule_matches"] = [r for r in exact + related if r not in already]
+
+    if result["status"] == "NO MATCH" and result["fuzzy_rule_matches"]:
+        result["status"] = "NEEDS REVIEW"
+        result["message"] = "Possible match on approximately spelled ingredients."
+    return result
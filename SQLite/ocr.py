@@ -0,0 +1,245 @@
+import io
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageSequence
+import pytesseract
+
+from ocr_preprocess import draft, preprocess
+
+# -------------------------
+# OCR config (Windows)
+# -------------------------
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+# pages of one document OCRed at a time; pytesseract runs Tesseract as a
+# subprocess, so threads are enough to keep several cores busy
+OCR_PAGE_WORKERS = int(os.environ.get("OCR_PAGE_WORKERS", os.cpu_count() or 2))
+# PDFs are rasterized at the DPI Tesseract is tuned for
+PDF_DPI = int(os.environ.get("OCR_PDF_DPI", 300))
+
+
+class DocumentError(ValueError):
+    pass
+
+# -------------------------
+# OCR backends
+# -------------------------
+# "pytesseract" runs the tesseract binary for every image: a new process,
+# temp files and a fresh language model load each time. "tesserocr" calls
+# libtesseract in-process and keeps its initialized engines, so only the
+# first image per engine pays for loading the model. "auto" uses tesserocr
+# when it is installed and pytesseract otherwise.
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto")
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+
+
+class PytesseractBackend:
+    name = "pytesseract"
+
+    def image_to_string(self, img):
+        return pytesseract.image_to_string(img, lang=OCR_LANG)
+
+
+class TesserocrBackend:
+    # Engines are created on demand, one per concurrent caller at most, and
+    # go back on an idle stack after each image. tesserocr releases the GIL
+    # while recognizing, so page threads share one process.
+    name = "tesserocr"
+
+    def __init__(self, tesserocr, lang=OCR_LANG, path=os.environ.get("TESSDATA_PREFIX")):
+        self.tesserocr = tesserocr
+        self.lang = lang
+        self.path = path
+        self.idle = queue.LifoQueue()
+        self.engines = 0
+        self.lock = threading.Lock()
+
+    def _engine(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        kwargs = {"lang": self.lang}
+        if self.path:
+            kwargs["path"] = self.path
+        engine = self.tesserocr.PyTessBaseAPI(**kwargs)
+        with self.lock:
+            self.engines += 1
+        return engine
+
+    def image_to_string(self, img):
+        engine = self._engine()
+        try:
+            engine.SetImage(img)
+            return engine.GetUTF8Text()
+        finally:
+            engine.Clear()
+            self.idle.put(engine)
+
+
+def load_backend(name=OCR_BACKEND):
+    if name not in ("auto", "tesserocr", "pytesseract"):
+        raise ValueError(f"Unknown OCR_BACKEND {name!r}")
+
+    if name != "pytesseract":
+        try:
+            import tesserocr
+            return TesserocrBackend(tesserocr)
+        except ImportError:
+            pass
+    return PytesseractBackend()
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = load_backend()
+    return _backend
+
+# -------------------------
+# OCR
+# -------------------------
+def page_to_text(img, timings=None, config=None):
+    if timings is None:
+        timings = {}
+
+    img = preprocess(img, config, timings)
+
+    start = time.perf_counter()
+    text = get_backend().image_to_string(img)
+    timings["ocr"] = round(time.perf_counter() - start, 4)
+
+    return text
+
+def image_to_text(image_bytes, timings=None, config=None):
+    # timings, when given, is filled with seconds spent per stage
+    if timings is None:
+        timings = {}
+
+    start = time.perf_counter()
+    img = draft(Image.open(io.BytesIO(image_bytes)), config)
+    img.load()
+    timings["decode"] = round(time.perf_counter() - start, 4)
+
+    return page_to_text(img, timings, config)
+
+# -------------------------
+# Multi-page documents
+# -------------------------
+def document_type(data):
+    if data[:5] == b"%PDF-":
+        return "pdf"
+    if data[:4] in (b"II*\0", b"MM\0*"):
+        return "tiff"
+    return None
+
+def is_document(data):
+    return document_type(data) is not None
+
+def _tiff_pages(data):
+    with Image.open(io.BytesIO(data)) as doc:
+        # ImageSequence seeks frame by frame, so only the current page is
+        # decoded; copy() detaches it before the next seek
+        for frame in ImageSequence.Iterator(doc):
+            yield frame.copy()
+
+def _pdf_pages(data):
+    try:
+        from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+    except ImportError:
+        raise DocumentError("PDF support needs the pdf2image package and poppler") from None
+
+    # one page per pdftoppm call instead of rasterizing the whole document
+    pages = pdfinfo_from_bytes(data)["Pages"]
+    for number in range(1, pages + 1):
+        yield convert_from_bytes(data, dpi=PDF_DPI, first_page=number, last_page=number)[0]
+
+def iter_pages(data):
+    # decoded pages one at a time, as (image, decode seconds)
+    kind = document_type(data)
+    if kind is None:
+        raise DocumentError("Not a PDF or TIFF document")
+
+    pages = _pdf_pages(data) if kind == "pdf" else _tiff_pages(data)
+    try:
+        for number in itertools.count(1):
+            start = time.perf_counter()
+            try:
+                img = next(pages)
+                img.load()
+            except StopIteration:
+                return
+            except DocumentError:
+                raise
+            except Exception as e:
+                # a file that only starts like a PDF/TIFF: Pillow and
+                # pdf2image raise all kinds of errors for truncated data
+                raise DocumentError(f"Could not read page {number} of the {kind.upper()}: {e}") from e
+            yield img, round(time.perf_counter() - start, 4)
+    finally:
+        pages.close()
+
+_page_pool = None
+
+def page_pool():
+    global _page_pool
+    if _page_pool is None:
+        _page_pool = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS, thread_name_prefix="ocr-page")
+    return _page_pool
+
+def _ocr_page(number, img, decode_seconds, config):
+    timings = {"decode": decode_seconds}
+    text = page_to_text(img, timings, config)
+    return {"page": number, "text": text, "timings": timings}
+
+def document_to_text(data, config=None, stop=None, workers=OCR_PAGE_WORKERS):
+    # [{page, text, timings}, ...] in page order, and whether stop ended the
+    # run early. Pages are decoded as the pool frees up, so at most
+    # workers + 1 decoded pages are held at once. stop(page) is called on
+    # each finished page, in order; returning True skips the rest.
+    pool = page_pool()
+    in_flight = deque()
+    pages = []
+
+    def collect():
+        page = in_flight.popleft().result()
+        pages.append(page)
+        return stop is not None and bool(stop(page))
+
+    stopped = False
+    source = iter_pages(data)
+    try:
+        for number, (img, decode_seconds) in enumerate(source, 1):
+            in_flight.append(pool.submit(_ocr_page, number, img, decode_seconds, config))
+            if len(in_flight) >= workers and collect():
+                stopped = True
+                break
+        while in_flight and not stopped:
+            stopped = collect()
+    finally:
+        source.close()
+        for future in in_flight:
+            future.cancel()
+
+    return pages, stopped
+
+def page_timings(pages):
+    # stage seconds summed over the pages, in the same shape image_to_text
+    # fills in for a single image
+    totals = {}
+    for page in pages:
+        for stage, seconds in page["timings"].items():
+            totals[stage] = round(totals.get(stage, 0.0) + seconds, 4)
+    return totals
+
+def merge_pages(pages):
+    return "\n\n".join(page["text"] for page in pages)
@@ -0,0 +1,201 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SQLITE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------------
+# Cache config
+# -------------------------
+OCR_CACHE_DB = os.environ.get("OCR_CACHE_DB", os.path.join(SQLITE_DIR, "ocr_cache.db"))
+OCR_CACHE_ENTRIES = int(os.environ.get("OCR_CACHE_ENTRIES", 256))
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# OCR_CACHE_PHASH=1 also reuses text across uploads whose bytes differ but
+# whose decoded pixels are identical (stripped metadata, lossless
+# re-compression). The perceptual hash only finds candidates: labels that
+# differ in a digit or two ("400mg" / "500mg") share it, so a hit must have
+# the same dimensions and pixel digest. Lossy re-encodes still miss.
+OCR_CACHE_PHASH = os.environ.get("OCR_CACHE_PHASH", "0") == "1"
+
+# -------------------------
+# Image keys
+# -------------------------
+def image_key(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def perceptual_hash(img):
+    # 64-bit difference hash of a grayscale image; a lookup hint only, far
+    # too coarse to tell similar labels apart
+    pixels = list(img.resize((9, 8)).getdata())
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+
+    return f"{bits:016x}"
+
+def image_signature(image_bytes):
+    # (perceptual hash, decoded pixel digest, width, height)
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    digest = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+    digest.update(img.tobytes())
+    return perceptual_hash(img.convert("L")), digest.hexdigest(), img.width, img.height
+
+# -------------------------
+# Two-tier cache
+# -------------------------
+class OcrCache:
+    # In-memory LRU of extracted text in front of a size-bounded SQLite
+    # table, keyed by the SHA-256 of the uploaded bytes.
+
+    def __init__(self, db_path=OCR_CACHE_DB, max_entries=OCR_CACHE_ENTRIES,
+                 max_bytes=OCR_CACHE_MAX_BYTES, use_phash=OCR_CACHE_PHASH):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.use_phash = use_phash
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                image_hash TEXT PRIMARY KEY,
+                phash TEXT,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        # caches written before near-duplicate verification lack these
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(ocr_cache)")}
+        for column, kind in (("pixels", "TEXT"), ("width", "INTEGER"), ("height", "INTEGER")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE ocr_cache ADD COLUMN {column} {kind}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash ON ocr_cache(phash)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache(last_used)")
+        conn.commit()
+        conn.close()
+
+    def _remember(self, key, text):
+        with self.lock:
+            self.memory[key] = text
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, image_bytes, key=None):
+        key = key or image_key(image_bytes)
+
+        with self.lock:
+            text = self.memory.get(key)
+            if text is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return text
+
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+
+        cur.execute("SELECT text FROM ocr_cache WHERE image_hash=?", (key,))
+        row = cur.fetchone()
+
+        signature = None
+        if row is None and self.use_phash:
+            signature = self._signature(image_bytes)
+            if signature:
+                row = self._near_duplicate(cur, signature)
+
+        if row is None:
+            conn.close()
+            self.misses += 1
+            return None
+
+        text = row[0]
+        if signature:
+            # near-duplicate upload, store it under its own byte hash too
+            self._store(cur, key, signature, text)
+        else:
+            cur.execute("UPDATE ocr_cache SET last_used=? WHERE image_hash=?", (time.time(), key))
+        conn.commit()
+        conn.close()
+
+        self._remember(key, text)
+        self.hits += 1
+        return text
+
+    def put(self, image_bytes, text, key=None):
+        key = key or image_key(image_bytes)
+        self._remember(key, text)
+
+        signature = self._signature(image_bytes) if self.use_phash else None
+
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        self._store(cur, key, signature, text)
+        self._evict(cur)
+        conn.commit()
+        conn.close()
+
+    def _signature(self, image_bytes):
+        try:
+            return image_signature(image_bytes)
+        except Exception:
+            return None
+
+    def _near_duplicate(self, cur, signature):
+        # the perceptual hash narrows the search; only an entry with the
+        # same decoded pixels counts as this image
+        phash, pixels, width, height = signature
+        cur.execute("""
+            SELECT text FROM ocr_cache
+            WHERE phash=? AND width=? AND height=? AND pixels=?
+            LIMIT 1
+        """, (phash, width, height, pixels))
+        return cur.fetchone()
+
+    def _store(self, cur, key, signature, text):
+        phash, pixels, width, height = signature or (None, None, None, None)
+        cur.execute("""
+            INSERT OR REPLACE INTO ocr_cache (image_hash, phash, pixels, width, height, text, size, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (key, phash, pixels, width, height, text, len(text.encode("utf-8")), time.time()))
+
+    def _evict(self, cur):
+        cur.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache")
+        total = cur.fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # drop least recently used rows until we are back under the bound
+        cur.execute("SELECT image_hash, size FROM ocr_cache ORDER BY last_used")
+        expired = []
+        for key, size in cur:
+            if total <= self.max_bytes:
+                break
+            expired.append((key,))
+            total -= size
+        cur.executemany("DELETE FROM ocr_cache WHERE image_hash=?", expired)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "memory_entries": len(self.memory),
+        }
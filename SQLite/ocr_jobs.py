@@ -0,0 +1,191 @@
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from ocr_cache import image_key
+
+# -------------------------
+# Queue config
+# -------------------------
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", 2))
+OCR_QUEUE_SIZE = int(os.environ.get("OCR_QUEUE_SIZE", 32))
+OCR_JOB_TTL = int(os.environ.get("OCR_JOB_TTL", 600))
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("OCR queue is full")
+        self.retry_after = retry_after
+
+# -------------------------
+# Worker process side
+# -------------------------
+def run_ocr(image_bytes):
+    # loaded inside the worker so spawned processes pick up the Tesseract config
+    from ocr import document_to_text, image_to_text, is_document, merge_pages, page_timings
+
+    started = time.time()
+    stages = {}
+    try:
+        if is_document(image_bytes):
+            # queued documents are read in full; the rule index lives in
+            # the web process, so there is nothing to stop early on here
+            pages, _ = document_to_text(image_bytes)
+            text = merge_pages(pages)
+            stages = page_timings(pages)
+        else:
+            text = image_to_text(image_bytes, stages)
+    except Exception as e:
+        # some pytesseract errors cannot be unpickled in the parent and would
+        # break the whole pool, so hand back a plain error instead
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    return text, started, time.time(), stages
+
+# -------------------------
+# Job queue
+# -------------------------
+class OcrJobQueue:
+    # Bounded queue in front of a pool of OCR worker processes. Jobs live in
+    # memory until OCR_JOB_TTL seconds after they finish.
+
+    def __init__(self, finish, cache=None, workers=OCR_WORKERS, max_pending=OCR_QUEUE_SIZE, ttl=OCR_JOB_TTL):
+        # finish(extracted_text, stages) -> verdict dict, run once OCR is
+        # done; stages holds the worker's stage timings and may be extended
+        self.finish = finish
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+
+        self.executor = None
+        self.jobs = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+
+        self.completed = 0
+        self.ocr_runs = 0
+        self.ocr_seconds_total = 0.0
+
+    def _executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def retry_after(self):
+        # rough time until a slot frees up, from the average OCR time so far
+        avg = self.ocr_seconds_total / self.ocr_runs if self.ocr_runs else 1.0
+        return max(1, math.ceil(avg * self.pending / self.workers))
+
+    def submit_many(self, images):
+        # cached images complete straight away and take no queue slot
+        lookups = []
+        for image_bytes in images:
+            key = text = None
+            if self.cache is not None:
+                key = image_key(image_bytes)
+                text = self.cache.get(image_bytes, key)
+            lookups.append((image_bytes, key, text))
+        misses = sum(1 for _, _, text in lookups if text is None)
+
+        with self.lock:
+            self._purge()
+            if self.pending + misses > self.max_pending:
+                raise QueueFull(self.retry_after())
+
+            job_ids = []
+            for image_bytes, key, text in lookups:
+                job_id = uuid.uuid4().hex
+                self.jobs[job_id] = {
+                    "job_id": job_id,
+                    "status": "queued",
+                    "submitted_at": time.time(),
+                }
+                job_ids.append(job_id)
+            self.pending += misses
+
+        for job_id, (image_bytes, key, text) in zip(job_ids, lookups):
+            if text is not None:
+                now = time.time()
+                self._complete(job_id, text, now, now, cached=True)
+                continue
+
+            try:
+                future = self._executor().submit(run_ocr, image_bytes)
+            except RuntimeError:
+                # broken or shut down pool, start a fresh one for later jobs
+                self.executor = None
+                future = self._executor().submit(run_ocr, image_bytes)
+            future.add_done_callback(
+                lambda f, job_id=job_id, image_bytes=image_bytes, key=key: self._done(job_id, f, image_bytes, key)
+            )
+
+        return job_ids
+
+    def submit(self, image_bytes):
+        return self.submit_many([image_bytes])[0]
+
+    def _done(self, job_id, future, image_bytes, key):
+        ocr_seconds = None
+        try:
+            extracted_text, started, ocr_done, stages = future.result()
+            ocr_seconds = ocr_done - started
+            if self.cache is not None:
+                self.cache.put(image_bytes, extracted_text, key)
+            self._complete(job_id, extracted_text, started, ocr_done, cached=False, stages=stages)
+        except Exception as e:
+            job = self.jobs[job_id]
+            job["status"] = "failed"
+            job["error"] = str(e)
+            job["finished_at"] = time.time()
+
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+            if ocr_seconds is not None:
+                self.ocr_runs += 1
+                self.ocr_seconds_total += ocr_seconds
+
+    def _complete(self, job_id, extracted_text, started, ocr_done, cached, stages=None):
+        job = self.jobs[job_id]
+
+        stages = dict(stages or {})
+        match_start = time.perf_counter()
+        result = self.finish(extracted_text, stages)
+        match_seconds = time.perf_counter() - match_start
+        result["ocr_cached"] = cached
+
+        job["result"] = result
+        job["status"] = "done"
+        job["timings"] = {
+            "queued_seconds": round(started - job["submitted_at"], 4),
+            "ocr_seconds": round(ocr_done - started, 4),
+            "match_seconds": round(match_seconds, 4),
+            "total_seconds": round(time.time() - job["submitted_at"], 4),
+            "stages": stages,
+        }
+        job["finished_at"] = time.time()
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.get("finished_at", math.inf) < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "avg_ocr_seconds": round(self.ocr_seconds_total / self.ocr_runs, 4) if self.ocr_runs else None,
+        }
@@ -0,0 +1,131 @@
+import os
+import time
+
+from PIL import Image, ImageOps
+
+# -------------------------
+# Preprocessing config
+# -------------------------
+# Tesseract is tuned for ~300 DPI text; phone photos are far larger than
+# that and OCR time grows with the pixel count.
+PREPROCESS_CONFIG = {
+    "enabled": os.environ.get("OCR_PREPROCESS", "1") == "1",
+    "target_dpi": int(os.environ.get("OCR_TARGET_DPI", 300)),
+    "max_pixels": int(os.environ.get("OCR_MAX_PIXELS", 3_000_000)),
+    "binarize": os.environ.get("OCR_BINARIZE", "1") == "1",
+    "crop": os.environ.get("OCR_CROP", "0") == "1",
+    "crop_margin": int(os.environ.get("OCR_CROP_MARGIN", 16)),
+}
+
+# -------------------------
+# Stages
+# -------------------------
+def draft(img, config=None):
+    # JPEG can be decoded directly at 1/2, 1/4 or 1/8 scale, which is much
+    # cheaper than decoding everything and resizing afterwards. Call before
+    # the image is loaded.
+    config = dict(PREPROCESS_CONFIG, **(config or {}))
+    if not config["enabled"] or img.format != "JPEG":
+        return img
+
+    w, h = img.size
+    scale = (config["max_pixels"] / float(w * h)) ** 0.5
+    if scale < 1.0:
+        img.draft("RGB", (int(w * scale), int(h * scale)))
+
+        # keep the DPI in step with the reduced size for downscale()
+        dpi = img.info.get("dpi")
+        if dpi and img.size[0] != w:
+            ratio = img.size[0] / float(w)
+            img.info["dpi"] = (dpi[0] * ratio, dpi[1] * ratio)
+    return img
+
+def exif_rotate(img, config):
+    return ImageOps.exif_transpose(img) or img
+
+def downscale(img, config):
+    w, h = img.size
+    scale = 1.0
+
+    dpi = img.info.get("dpi")
+    if dpi and dpi[0] and dpi[0] > config["target_dpi"]:
+        scale = config["target_dpi"] / float(dpi[0])
+
+    if w * h * scale * scale > config["max_pixels"]:
+        scale = (config["max_pixels"] / float(w * h)) ** 0.5
+
+    if scale >= 1.0:
+        return img
+
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    return img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+def grayscale(img, config):
+    return img if img.mode == "L" else img.convert("L")
+
+def otsu_threshold(histogram):
+    total = sum(histogram)
+    sum_all = sum(i * n for i, n in enumerate(histogram))
+
+    best, threshold = 0.0, 127
+    weight_bg = sum_bg = 0
+    for i, n in enumerate(histogram):
+        weight_bg += n
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * n
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+def binarize(img, config):
+    if not config["binarize"]:
+        return img
+    threshold = otsu_threshold(img.histogram()[:256])
+    return img.point(lambda p: 255 if p > threshold else 0)
+
+def crop_text_region(img, config):
+    if not config["crop"]:
+        return img
+
+    # bounding box of the dark (text) pixels
+    bbox = ImageOps.invert(img).getbbox()
+    if not bbox:
+        return img
+
+    m = config["crop_margin"]
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(0, left - m), max(0, top - m),
+        min(img.width, right + m), min(img.height, bottom + m)
+    ))
+
+STAGES = [
+    ("exif_rotate", exif_rotate),
+    ("downscale", downscale),
+    ("grayscale", grayscale),
+    ("binarize", binarize),
+    ("crop", crop_text_region),
+]
+
+# -------------------------
+# Pipeline
+# -------------------------
+def preprocess(img, config=None, timings=None):
+    config = dict(PREPROCESS_CONFIG, **(config or {}))
+    if not config["enabled"]:
+        return img
+
+    for name, stage in STAGES:
+        start = time.perf_counter()
+        img = stage(img, config)
+        if timings is not None:
+            timings[name] = round(time.perf_counter() - start, 4)
+
+    return img
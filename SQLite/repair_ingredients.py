@@ -1,5 +1,13 @@
+import argparse
+import hashlib
 import sqlite3
 import re
+from multiprocessing import Pool
+
+from keyword_matcher import KeywordMatcher
+from rule_snapshot import refresh_snapshot
+from rule_store import ensure_schema, prune_rule_changes, sync_rule_ingredients
+from shards import DEFAULT_JURISDICTION, JURISDICTIONS, shard_db_name
 
 DB_NAME = "rules.db"
 
@@ -21,6 +29,11 @@ CATEGORY_KEYWORDS = {
     "cardiac", "respiratory", "dermatological"
 }
 
+# molecules must start a word ("cetirizine" is not in "levocetirizine"),
+# category stems may sit inside one ("antidiarrhoeal" -> diarrhoea)
+INGREDIENT_MATCHER = KeywordMatcher(KNOWN_INGREDIENTS)
+CATEGORY_MATCHER = KeywordMatcher(CATEGORY_KEYWORDS, word_start=False)
+
 
 STOPWORDS = {
     "fixed", "dose", "combination", "combinations",
@@ -96,14 +109,11 @@ def extract_tokens_from_name(name, risk_level):
     tokens = set()
 
     # 1. Known molecules and salts
-    for ing in KNOWN_INGREDIENTS:
-        if ing in t:
-            tokens.add(ing)
+    tokens.update(INGREDIENT_MATCHER.find(t))
 
     # 2. Explicit categories
-    for cat in CATEGORY_KEYWORDS:
-        if cat in t:
-            tokens.add(cat.rstrip("s"))
+    for cat in CATEGORY_MATCHER.find(t):
+        tokens.add(cat.rstrip("s"))
 
     # 3. Patterns: "for X", "used in X"
     patterns = [
@@ -141,28 +151,110 @@ def extract_tokens_from_name(name, risk_level):
 
 
 
-def repair_database():
-    conn = sqlite3.connect(DB_NAME)
+# -------------------------------
+# INCREMENTAL REPAIR STATE
+# -------------------------------
+
+# bump when extract_tokens_from_name changes in a way the word lists
+# below do not capture
+EXTRACTOR_VERSION = 2
+
+def dictionary_version():
+    h = hashlib.sha1(str(EXTRACTOR_VERSION).encode())
+    for words in (KNOWN_INGREDIENTS, CATEGORY_KEYWORDS, STOPWORDS):
+        h.update("\0".join(sorted(words)).encode())
+        h.update(b"\1")
+    return h.hexdigest()
+
+DICT_VERSION = dictionary_version()
+
+def input_hash(name, risk_level):
+    return hashlib.sha1(f"{name}\0{risk_level}".encode("utf-8")).hexdigest()
+
+def ensure_repair_state(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rule_extraction_state (
+            rule_id INTEGER PRIMARY KEY,
+            input_hash TEXT NOT NULL,
+            dict_version TEXT NOT NULL
+        )
+    """)
+
+def extract_batch(rows):
+    return [
+        (rule_id, extract_tokens_from_name(name, risk), digest)
+        for rule_id, name, risk, digest in rows
+    ]
+
+def chunked(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+# -------------------------------
+# REPAIR
+# -------------------------------
+
+PARALLEL_MIN_ROWS = 5000
+
+def repair_database(workers=1, full=False, db_name=DB_NAME):
+    # older databases predate the version triggers and derived tables
+    ensure_schema(db_name)
+
+    conn = sqlite3.connect(db_name)
     cur = conn.cursor()
+    ensure_repair_state(cur)
+
+    cur.execute("""
+        SELECT r.rule_id, r.name, r.risk_level, r.ingredients, s.input_hash, s.dict_version
+        FROM regulatory_rules r
+        LEFT JOIN rule_extraction_state s ON s.rule_id = r.rule_id
+    """)
 
-    cur.execute("SELECT rule_id, name, risk_level, ingredients FROM regulatory_rules")
-    rows = cur.fetchall()
+    # only rows whose name/risk or the extraction dictionaries changed since
+    # the last run need to be extracted again
+    todo = []
+    current = {}
+    for rule_id, name, risk, old_ing, old_hash, old_dict in cur.fetchall():
+        digest = input_hash(name, risk)
+        if not full and old_hash == digest and old_dict == DICT_VERSION:
+            continue
+        todo.append((rule_id, name, risk, digest))
+        current[rule_id] = old_ing
 
-    fixes = 0
+    if workers > 1 and len(todo) >= PARALLEL_MIN_ROWS:
+        with Pool(workers) as pool:
+            results = [r for batch in pool.map(extract_batch, chunked(todo, 1000)) for r in batch]
+    else:
+        results = extract_batch(todo)
 
-    for rule_id, name, risk, old_ing in rows:
-        new_ing = extract_tokens_from_name(name, risk)
+    updates = [
+        (new_ing, rule_id)
+        for rule_id, new_ing, _ in results
+        if new_ing != current[rule_id]
+    ]
 
-        if new_ing != old_ing:
-            cur.execute(
-                "UPDATE regulatory_rules SET ingredients = ? WHERE rule_id = ?",
-                (new_ing, rule_id)
-            )
-            fixes += 1
+    cur.executemany("UPDATE regulatory_rules SET ingredients = ? WHERE rule_id = ?", updates)
+    sync_rule_ingredients(cur, [(rule_id, new_ing) for new_ing, rule_id in updates])
+    prune_rule_changes(cur)
+    cur.executemany("""
+        INSERT OR REPLACE INTO rule_extraction_state (rule_id, input_hash, dict_version)
+        VALUES (?, ?, ?)
+    """, [(rule_id, digest, DICT_VERSION) for rule_id, _, digest in results])
+    cur.execute("""
+        DELETE FROM rule_extraction_state
+        WHERE rule_id NOT IN (SELECT rule_id FROM regulatory_rules)
+    """)
 
     conn.commit()
     conn.close()
-    print(f"Repaired {fixes} rows.")
+    refresh_snapshot(db_name)
+    print(f"Checked {len(todo)} rows, repaired {len(updates)} rows.")
 
 if __name__ == "__main__":
-    repair_database()
+    parser = argparse.ArgumentParser(description="Re-extract ingredient tokens for changed rules.")
+    parser.add_argument("--workers", type=int, default=1, help="extraction processes for large tables")
+    parser.add_argument("--full", action="store_true", help="reprocess every rule")
+    parser.add_argument("--jurisdiction", default=DEFAULT_JURISDICTION, choices=sorted(JURISDICTIONS),
+                        help="rules shard to repair")
+    args = parser.parse_args()
+
+    repair_database(workers=args.workers, full=args.full, db_name=shard_db_name(args.jurisdiction))
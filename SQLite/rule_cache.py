@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import threading
+import time
+
+from matcher import PatchedIndex, RuleIndex, patch_index
+from rule_snapshot import load_snapshot, snapshot_path
+from rule_store import change_log_position, get_rules_version, rule_changes_since, rules_by_id, table_exists
+
+# past this many edited rules a full reload is cheaper than the overlay
+RULE_PATCH_LIMIT = int(os.environ.get("RULE_PATCH_LIMIT", 5000))
+
+# -------------------------
+# Process-wide rule cache
+# -------------------------
+class RuleCache:
+    # Holds the parsed RuleIndex for one rules database.
+    #
+    # The hot path only stats the database files: as long as neither rules.db
+    # nor its WAL changed on disk, the cached index is served without touching
+    # SQLite. When they did change, rules_version decides whether the rule set
+    # really moved and the index needs a reload.
+    #
+    # A reload maps the precompiled snapshot (rule_snapshot.py) when its
+    # version matches, and only parses the rows from SQLite otherwise. The
+    # snapshot file is part of the signature, so a rebuilt snapshot is picked
+    # up as soon as it is renamed into place.
+    #
+    # Without a current snapshot, edits listed in the rule_changes log are
+    # patched onto the loaded index: only the changed rows are read back.
+
+    def __init__(self, db_path, snapshot=None):
+        self.db_path = db_path
+        self.snapshot = snapshot or snapshot_path(db_path)
+        self.index = None
+        self.version = None
+        self.signature = None
+        self.source = None
+        self.change_seq = None
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.checks = 0
+        self.loads = 0
+        self.patches = 0
+        self.load_seconds = 0.0
+
+    def _signature(self):
+        sig = []
+        for path in (self.db_path, self.db_path + "-wal", self.snapshot):
+            try:
+                st = os.stat(path)
+                sig.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def get_index(self):
+        signature = self._signature()
+        if self.index is not None and signature == self.signature:
+            self.hits += 1
+            return self.index
+
+        with self.lock:
+            if self.index is not None and signature == self.signature:
+                self.hits += 1
+                return self.index
+            self._refresh(signature)
+            return self.index
+
+    def _refresh(self, signature):
+        conn = sqlite3.connect(self.db_path)
+        cur = conn.cursor()
+        try:
+            # read the version and the rows from one snapshot
+            cur.execute("BEGIN")
+            version = get_rules_version(cur)
+            self.checks += 1
+
+            if self.index is None or version != self.version or self.source != "snapshot":
+                self._load(cur, version)
+                self.version = version
+
+            self.signature = signature
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def _load(self, cur, version):
+        start = time.perf_counter()
+
+        snapshot = load_snapshot(self.snapshot)
+        if snapshot is not None and snapshot.version == version:
+            self.index = snapshot
+            self.source = "snapshot"
+        elif self.index is not None and version != self.version and self._patch(cur):
+            self.source = "patch"
+            self.patches += 1
+        elif self.index is None or version != self.version:
+            cur.execute("SELECT rule_id, name, ingredients FROM regulatory_rules ORDER BY rule_id")
+            self.index = RuleIndex(cur.fetchall())
+            self.source = "sqlite"
+        else:
+            # no snapshot for this version yet, the loaded rules are current
+            return
+
+        # the index now reflects the change log up to here
+        self.change_seq = change_log_position(cur) if table_exists(cur, "rule_changes") else None
+        self.load_seconds = time.perf_counter() - start
+        self.loads += 1
+
+    def _patch(self, cur):
+        if self.change_seq is None:
+            return False
+        changes = rule_changes_since(cur, self.change_seq)
+        if changes is None:
+            return False
+
+        _, rule_ids = changes
+        already = self.index.changed if isinstance(self.index, PatchedIndex) else ()
+        if len(already) + len(rule_ids) > RULE_PATCH_LIMIT:
+            return False
+
+        # a version bump without logged rows (say a risk_level edit) leaves
+        # the index as it is
+        if rule_ids:
+            self.index = patch_index(self.index, rule_ids, rules_by_id(cur, rule_ids))
+        return True
+
+    def invalidate(self):
+        # force a version check on the next lookup, used right after the
+        # app itself wrote to regulatory_rules
+        with self.lock:
+            self.signature = None
@@ -0,0 +1,321 @@
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from batch_match import BatchTables
+from fuzzy import FuzzyIndex
+from matcher import parse_rule_tokens
+from rule_store import get_rules_version, table_exists
+
+# -------------------------
+# Snapshot file format
+# -------------------------
+# A read-only, precompiled RuleIndex. Every worker maps the same file, so the
+# pages are shared between processes and loading costs a header parse
+# instead of a table scan.
+#
+#   header
+#   token_table     u32[slots]        open-addressing hash of the tokens
+#                                     (crc32, linear probing), token + 1 or 0
+#   token_offsets   u32[tokens + 1]   into the token blob, tokens sorted
+#   posting_offsets u32[tokens + 1]   into postings
+#   postings        u32[postings]     rule positions, ascending per token
+#   rule_ids        u32[rules]        ascending
+#   required        u32[rules]        distinct tokens each rule needs
+#   name_offsets    u32[rules + 1]    into the name blob
+#   token blob, name blob             UTF-8
+#
+# Arrays are in native byte order; the marker tells a reader on a different
+# platform to fall back to SQLite.
+MAGIC = b"RULESNAP"
+FORMAT_VERSION = 2
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct("=8sIIQIIIIII")
+
+def snapshot_path(db_path):
+    return os.path.splitext(db_path)[0] + ".snapshot"
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+def _u32(values):
+    return array("I", values)
+
+def _table_slots(n_tokens):
+    # power of two, at most half full
+    slots = 8
+    while slots < 2 * n_tokens:
+        slots *= 2
+    return slots
+
+def _token_table(token_bytes):
+    slots = _table_slots(len(token_bytes))
+    table = [0] * slots
+    for i, key in enumerate(token_bytes):
+        slot = zlib.crc32(key) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i + 1
+    return table
+
+# -------------------------
+# Build
+# -------------------------
+def read_rules(db_path):
+    # the version and the rows come from one read transaction
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN")
+        version = get_rules_version(cur)
+        cur.execute("SELECT rule_id, name, ingredients FROM regulatory_rules ORDER BY rule_id")
+        rows = cur.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+    return version, rows
+
+def build_snapshot(db_path, path=None):
+    path = path or snapshot_path(db_path)
+    version, rows = read_rules(db_path)
+
+    # same rules as RuleIndex: rules without tokens can never match
+    rules = []
+    postings = defaultdict(list)
+    for rule_id, name, ing_text in rows:
+        tokens = parse_rule_tokens(ing_text)
+        if not tokens:
+            continue
+        for tok in tokens:
+            postings[tok].append(len(rules))
+        rules.append((rule_id, len(tokens), (name or "").encode("utf-8")))
+
+    tokens = sorted(postings)
+    token_bytes = [t.encode("utf-8") for t in tokens]
+
+    token_offsets = [0]
+    for t in token_bytes:
+        token_offsets.append(token_offsets[-1] + len(t))
+    posting_offsets = [0]
+    for t in tokens:
+        posting_offsets.append(posting_offsets[-1] + len(postings[t]))
+    name_offsets = [0]
+    for _, _, name in rules:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    table = _token_table(token_bytes)
+    sections = [
+        _u32(table).tobytes(),
+        _u32(token_offsets).tobytes(),
+        _u32(posting_offsets).tobytes(),
+        _u32(pos for t in tokens for pos in postings[t]).tobytes(),
+        _u32(r[0] for r in rules).tobytes(),
+        _u32(r[1] for r in rules).tobytes(),
+        _u32(name_offsets).tobytes(),
+        b"".join(token_bytes),
+        b"".join(r[2] for r in rules),
+    ]
+    header = HEADER.pack(
+        MAGIC, BYTE_ORDER_MARK, FORMAT_VERSION, version, len(table),
+        len(tokens), len(rules), posting_offsets[-1], token_offsets[-1], name_offsets[-1]
+    )
+
+    # write next to the target and rename over it: readers holding the old
+    # file keep their mapping, new readers see the complete new file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header + b"\0" * _pad(len(header)))
+        for data in sections:
+            f.write(data + b"\0" * _pad(len(data)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return version, len(rules)
+
+# -------------------------
+# Load
+# -------------------------
+class RuleSnapshot:
+    # Drop-in for RuleIndex (match, fuzzy, len) backed by a mapped snapshot.
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, mark, fmt, self.version, slots, n_tokens, n_rules, n_postings, token_len, name_len = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or mark != BYTE_ORDER_MARK or fmt != FORMAT_VERSION:
+            self.mm.close()
+            raise ValueError(f"{path} is not a compatible rule snapshot")
+
+        self.n_tokens = n_tokens
+        self.n_rules = n_rules
+        self._fuzzy = None
+        # names decoded so far; only rules that actually matched get one
+        self._names = {}
+        self._batch = None
+
+        view = memoryview(self.mm)
+        offset = HEADER.size + _pad(HEADER.size)
+
+        def take(size, fmt=None):
+            nonlocal offset
+            part = view[offset:offset + size]
+            offset += size + _pad(size)
+            return part.cast(fmt) if fmt else part
+
+        self.slots = slots
+        self.token_table = take(4 * slots, "I")
+        self.token_offsets = take(4 * (n_tokens + 1), "I")
+        self.posting_offsets = take(4 * (n_tokens + 1), "I")
+        self.postings = take(4 * n_postings, "I")
+        self.rule_ids = take(4 * n_rules, "I")
+        self.required = take(4 * n_rules, "I")
+        self.name_offsets = take(4 * (n_rules + 1), "I")
+        self.token_blob = take(token_len)
+        self.name_blob = take(name_len)
+
+    def __len__(self):
+        return self.n_rules
+
+    def _token(self, i):
+        return bytes(self.token_blob[self.token_offsets[i]:self.token_offsets[i + 1]])
+
+    def _find(self, token):
+        key = token.encode("utf-8")
+        mask = self.slots - 1
+        slot = zlib.crc32(key) & mask
+        while True:
+            entry = self.token_table[slot]
+            if not entry:
+                return -1
+            if self._token(entry - 1) == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def _name(self, pos):
+        name = self._names.get(pos)
+        if name is None:
+            start, end = self.name_offsets[pos], self.name_offsets[pos + 1]
+            name = self._names[pos] = str(self.name_blob[start:end], "utf-8")
+        return name
+
+    def tokens(self):
+        return [self._token(i).decode("utf-8") for i in range(self.n_tokens)]
+
+    def __contains__(self, rule_id):
+        pos = bisect_left(self.rule_ids, rule_id)
+        return pos < self.n_rules and self.rule_ids[pos] == rule_id
+
+    def _hits(self, user_tokens):
+        # Counter.update counts a posting slice in C
+        hits = Counter()
+        for tok in user_tokens:
+            i = self._find(tok)
+            if i >= 0:
+                hits.update(self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]])
+        return hits
+
+    def match_rules(self, user_tokens):
+        # [(rule_id, name, exact), ...] in rule_id order
+        hits = self._hits(user_tokens)
+        return [
+            (self.rule_ids[pos], self._name(pos), hits[pos] == self.required[pos])
+            for pos in sorted(hits)
+        ]
+
+    def match(self, user_tokens):
+        hits = self._hits(user_tokens)
+
+        exact = []
+        related = []
+        names = self._names
+        required = self.required
+
+        # positions follow rule_id order
+        for pos in sorted(hits):
+            name = names.get(pos) or self._name(pos)
+            if hits[pos] == required[pos]:
+                exact.append(name)
+            else:
+                related.append(name)
+
+        return exact, related
+
+    def fuzzy(self):
+        if self._fuzzy is None:
+            self._fuzzy = FuzzyIndex(self.tokens())
+        return self._fuzzy
+
+    def batch_tables(self, np):
+        # posting and required arrays are views of the mapping, keyed by
+        # rule position; only the name table is materialized
+        if self._batch is None:
+            postings = np.frombuffer(self.postings, dtype=np.uint32)
+            required = np.frombuffer(self.required, dtype=np.uint32)
+            names = np.empty(self.n_rules, dtype=object)
+            for pos in range(self.n_rules):
+                names[pos] = self._name(pos)
+
+            def lookup(token):
+                i = self._find(token)
+                if i < 0:
+                    return None
+                return postings[self.posting_offsets[i]:self.posting_offsets[i + 1]]
+
+            self._batch = BatchTables(lookup, required, names)
+        return self._batch
+
+def load_snapshot(path):
+    # None when there is no usable snapshot; callers fall back to SQLite
+    try:
+        return RuleSnapshot(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+_refresh_lock = threading.Lock()
+
+def refresh_snapshot_in_background(db_path, path=None):
+    # rebuilds run one at a time; one queued behind another usually finds
+    # the snapshot current already and returns without writing
+    def run():
+        with _refresh_lock:
+            refresh_snapshot(db_path, path)
+
+    thread = threading.Thread(target=run, name="snapshot-refresh", daemon=True)
+    thread.start()
+    return thread
+
+def refresh_snapshot(db_path, path=None):
+    # rebuild only when the snapshot is missing or behind rules_version;
+    # returns True when a new snapshot was written
+    path = path or snapshot_path(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        # nothing to compile before backend.py has created the rules tables
+        if not table_exists(cur, "rules_version"):
+            return False
+        version = get_rules_version(cur)
+    finally:
+        conn.close()
+
+    current = load_snapshot(path)
+    if current is not None and current.version == version:
+        return False
+    build_snapshot(db_path, path)
+    return True
+
+if __name__ == "__main__":
+    # python rule_snapshot.py [path/to/rules.db]
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "rules.db"
+    version, count = build_snapshot(db_path)
+    print(f"{snapshot_path(db_path)}: {count} rules at version {version}.")
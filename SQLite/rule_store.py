@@ -0,0 +1,439 @@
+import json
+import re
+import sqlite3
+import sys
+
+# -------------------------
+# Rules version counter
+# -------------------------
+# Every write to regulatory_rules bumps rules_version through triggers, so
+# in-memory caches notice changes made by the app, backend.py or
+# repair_ingredients.py alike.
+VERSION_TRIGGERS = {
+    "rules_version_insert": "AFTER INSERT ON regulatory_rules",
+    "rules_version_update": "AFTER UPDATE ON regulatory_rules",
+    "rules_version_delete": "AFTER DELETE ON regulatory_rules",
+}
+
+def ensure_rules_version(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rules_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO rules_version (id, version) VALUES (1, 0)")
+
+    for trigger, event in VERSION_TRIGGERS.items():
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {trigger} {event}
+            BEGIN
+                UPDATE rules_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+def get_rules_version(cur):
+    cur.execute("SELECT version FROM rules_version WHERE id = 1")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def bump_rules_version(cur):
+    cur.execute("UPDATE rules_version SET version = version + 1 WHERE id = 1")
+
+# -------------------------
+# Normalized rule tokens
+# -------------------------
+# rule_ingredients mirrors regulatory_rules.ingredients one token per row,
+# so token lookups are index seeks instead of splitting every rule in Python.
+def split_ingredients(ing_text):
+    if not ing_text or ing_text == "category_only":
+        return []
+    return sorted({t.strip() for t in ing_text.split(",") if t.strip()})
+
+def create_rule_ingredients_table(cur, table="rule_ingredients"):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            rule_id INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            PRIMARY KEY (rule_id, token)
+        ) WITHOUT ROWID
+    """)
+
+def ensure_rule_ingredients(cur):
+    create_rule_ingredients_table(cur)
+    # the primary key already serves lookups by rule_id
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rule_ingredients_token ON rule_ingredients(token, rule_id)")
+
+def ingredient_rows(rows):
+    # (rule_id, ingredients) pairs -> (rule_id, token) rows
+    return [
+        (rule_id, token)
+        for rule_id, ing_text in rows
+        for token in split_ingredients(ing_text)
+    ]
+
+def sync_rule_ingredients(cur, rows):
+    # rows: (rule_id, ingredients) pairs whose ingredients were just written
+    rows = list(rows)
+    cur.executemany("DELETE FROM rule_ingredients WHERE rule_id = ?", [(rule_id,) for rule_id, _ in rows])
+    cur.executemany("INSERT INTO rule_ingredients (rule_id, token) VALUES (?, ?)", ingredient_rows(rows))
+
+def rebuild_rule_ingredients(cur):
+    cur.execute("DELETE FROM rule_ingredients")
+    cur.execute("SELECT rule_id, ingredients FROM regulatory_rules")
+    cur.executemany("INSERT INTO rule_ingredients (rule_id, token) VALUES (?, ?)", ingredient_rows(cur.fetchall()))
+    mark_derived(cur, "rule_ingredients")
+
+# -------------------------
+# Dashboard browsing
+# -------------------------
+# Columns the dashboard may sort on. Each has an index ending in rule_id, so a
+# page is a range scan from the keyset cursor whatever the table size.
+# sort key -> (column, position in a rules_page row)
+SORT_COLUMNS = {
+    "rule_id": ("rule_id", 0),
+    "name": ("name", 1),
+    "risk": ("risk_level", 3),
+}
+
+RULE_INDEXES = {
+    "idx_rules_risk_level": "regulatory_rules(risk_level, rule_id)",
+    "idx_rules_type": "regulatory_rules(type, rule_id)",
+    "idx_rules_name": "regulatory_rules(name, rule_id)",
+}
+
+def ensure_rule_indexes(cur):
+    for index, columns in RULE_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {columns}")
+
+    if table_exists(cur, "pending_changes"):
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pending_changes_status ON pending_changes(status, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pending_changes_rule ON pending_changes(rule_id, status)")
+
+def rules_page(cur, risk_level=None, rule_type=None, token=None,
+               sort="rule_id", descending=False, after=None, limit=50):
+    # One page of rules plus the cursor for the next one (None on the last
+    # page). after is the (sort value, rule_id) pair of the previous page's
+    # last row.
+    column, position = SORT_COLUMNS[sort]
+    where, params = [], []
+
+    if risk_level:
+        where.append("risk_level = ?")
+        params.append(risk_level)
+    if rule_type:
+        where.append("type = ?")
+        params.append(rule_type)
+    if token:
+        where.append("rule_id IN (SELECT rule_id FROM rule_ingredients WHERE token = ?)")
+        params.append(token)
+    if after is not None:
+        op = "<" if descending else ">"
+        if column == "rule_id":
+            where.append(f"rule_id {op} ?")
+            params.append(after[1])
+        else:
+            where.append(f"({column}, rule_id) {op} (?, ?)")
+            params.extend(after)
+
+    direction = "DESC" if descending else "ASC"
+    order = "rule_id" if column == "rule_id" else f"{column} {direction}, rule_id"
+    sql = "SELECT rule_id, name, ingredients, risk_level, type FROM regulatory_rules"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {order} {direction} LIMIT ?"
+
+    # one extra row tells whether there is a next page
+    cur.execute(sql, params + [limit + 1])
+    rows = cur.fetchall()
+
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        cursor = (last[position], last[0])
+    return rows, cursor
+
+def pending_page(cur, after=None, limit=50):
+    sql = "SELECT id, rule_id, proposed_name, status FROM pending_changes WHERE status='PENDING'"
+    params = []
+    if after is not None:
+        sql += " AND id > ?"
+        params.append(after)
+    cur.execute(sql + " ORDER BY id LIMIT ?", params + [limit + 1])
+    rows = cur.fetchall()
+
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][0]
+    return rows, None
+
+# -------------------------
+# Full-text search
+# -------------------------
+# rules_fts is an external-content FTS5 index over regulatory_rules: it stores
+# only the index, the text itself is read from regulatory_rules. The prefix
+# option keeps short prefix queries ("nime*") to a single index range.
+FTS_TRIGGERS = {
+    "rules_fts_insert": """
+        AFTER INSERT ON regulatory_rules BEGIN
+            INSERT INTO rules_fts (rowid, name, ingredients) VALUES (new.rule_id, new.name, new.ingredients);
+        END
+    """,
+    "rules_fts_delete": """
+        AFTER DELETE ON regulatory_rules BEGIN
+            INSERT INTO rules_fts (rules_fts, rowid, name, ingredients) VALUES ('delete', old.rule_id, old.name, old.ingredients);
+        END
+    """,
+    "rules_fts_update": """
+        AFTER UPDATE ON regulatory_rules BEGIN
+            INSERT INTO rules_fts (rules_fts, rowid, name, ingredients) VALUES ('delete', old.rule_id, old.name, old.ingredients);
+            INSERT INTO rules_fts (rowid, name, ingredients) VALUES (new.rule_id, new.name, new.ingredients);
+        END
+    """,
+}
+
+# snippet() markers; callers escape the text and then turn these into markup
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+def ensure_rules_fts(cur):
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS rules_fts USING fts5(
+            name, ingredients,
+            content='regulatory_rules', content_rowid='rule_id',
+            prefix='2 3'
+        )
+    """)
+    for trigger, body in FTS_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} {body}")
+
+    # rank = bm25 with rule names weighing more than ingredient lists
+    cur.execute("INSERT INTO rules_fts (rules_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+def rebuild_rules_fts(cur):
+    # needed whenever regulatory_rules was filled without the triggers
+    cur.execute("INSERT INTO rules_fts (rules_fts) VALUES ('rebuild')")
+    mark_derived(cur, "rules_fts")
+
+def fts_query(text):
+    # free text -> FTS5 query: every word must match as a prefix, so partial
+    # names ("nime para") find rules while the user is still typing. Words
+    # are quoted, so FTS5 operators in the input are never interpreted.
+    words = re.findall(r"[^\W_]+", (text or "").lower())
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+def search_rules(cur, text, limit=20):
+    # best matches first. Only the top rows are joined back to
+    # regulatory_rules and get snippets; ranking itself still scores every
+    # matching row, so very common prefixes are the slowest queries.
+    query = fts_query(text)
+    if query is None:
+        return []
+
+    cur.execute("""
+        WITH top AS (
+            SELECT rowid, rank FROM rules_fts
+            WHERE rules_fts MATCH :query
+            ORDER BY rank
+            LIMIT :limit
+        )
+        SELECT r.rule_id, r.name, r.ingredients, r.risk_level, r.type,
+               snippet(rules_fts, 0, :start, :end, '...', 12),
+               snippet(rules_fts, 1, :start, :end, '...', 12)
+        FROM top
+        JOIN rules_fts ON rules_fts.rowid = top.rowid
+        JOIN regulatory_rules r ON r.rule_id = top.rowid
+        WHERE rules_fts MATCH :query
+        ORDER BY top.rank
+    """, {"query": query, "limit": limit, "start": MARK_START, "end": MARK_END})
+    return cur.fetchall()
+
+# -------------------------
+# Rule change log
+# -------------------------
+# rule_changes lists the rules each write touched, so a process holding a
+# rule index can re-read just those rows instead of the whole table. A NULL
+# rule_id marks a full reload (backend.py swapping in a new table); readers
+# behind it start over.
+CHANGE_TRIGGERS = {
+    "rule_changes_insert": ("AFTER INSERT ON regulatory_rules", """
+        INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id);
+    """),
+    "rule_changes_update": ("AFTER UPDATE OF rule_id, name, ingredients ON regulatory_rules", """
+        INSERT INTO rule_changes (rule_id) VALUES (NEW.rule_id);
+        INSERT INTO rule_changes (rule_id) SELECT OLD.rule_id WHERE OLD.rule_id != NEW.rule_id;
+    """),
+    "rule_changes_delete": ("AFTER DELETE ON regulatory_rules", """
+        INSERT INTO rule_changes (rule_id) VALUES (OLD.rule_id);
+    """),
+}
+
+CHANGE_LOG_KEEP = 50000
+
+def ensure_rule_changes(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rule_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule_id INTEGER
+        )
+    """)
+
+    for trigger, (event, body) in CHANGE_TRIGGERS.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger} {event} BEGIN {body} END")
+
+def mark_rules_reloaded(cur):
+    cur.execute("DELETE FROM rule_changes")
+    cur.execute("INSERT INTO rule_changes (rule_id) VALUES (NULL)")
+
+def prune_rule_changes(cur, keep=CHANGE_LOG_KEEP):
+    cur.execute("DELETE FROM rule_changes WHERE seq <= (SELECT MAX(seq) FROM rule_changes) - ?", (keep,))
+
+def change_log_position(cur):
+    # seq of the latest logged change; AUTOINCREMENT never hands it out again
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rule_changes'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def rule_changes_since(cur, seq):
+    # (position, sorted rule_ids) changed after seq, or None when the log
+    # cannot say: entries were pruned, or the table was reloaded in between
+    end = change_log_position(cur)
+    cur.execute("SELECT rule_id FROM rule_changes WHERE seq > ?", (seq,))
+    rule_ids = [row[0] for row in cur.fetchall()]
+
+    if len(rule_ids) != end - seq or None in rule_ids:
+        return None
+    return end, sorted(set(rule_ids))
+
+def rules_by_id(cur, rule_ids):
+    # (rule_id, name, ingredients) of those rules that still exist
+    cur.execute("""
+        SELECT rule_id, name, ingredients FROM regulatory_rules
+        WHERE rule_id IN (SELECT value FROM json_each(?))
+        ORDER BY rule_id
+    """, (json.dumps(list(rule_ids)),))
+    return cur.fetchall()
+
+# -------------------------
+# Pending change review
+# -------------------------
+def review_pending_changes(cur, approve=(), reject=()):
+    # Applies a superadmin's decisions in the caller's transaction. An
+    # approval is held back as a conflict while another pending change for
+    # the same rule stays pending, so one edit never silently overwrites
+    # another; rejecting the other one in the same call resolves it.
+    approve, reject = set(approve), set(reject)
+    if any(type(i) is not int for i in approve | reject):
+        # int() would quietly turn 1.5 or True into change 1
+        raise TypeError("change ids must be integers")
+    reject -= approve
+    wanted = approve | reject
+
+    pending = {}
+    if wanted:
+        cur.execute("""
+            SELECT id, rule_id, proposed_name, proposed_ingredients, proposed_risk_level
+            FROM pending_changes
+            WHERE status = 'PENDING' AND rule_id IN (
+                SELECT rule_id FROM pending_changes
+                WHERE status = 'PENDING' AND id IN (SELECT value FROM json_each(?))
+            )
+        """, (json.dumps(sorted(wanted)),))
+        for row in cur.fetchall():
+            pending.setdefault(row[1], []).append(row)
+
+    # what stays pending per rule once the rejections are through
+    by_id = {row[0]: row for rows in pending.values() for row in rows}
+    open_changes = {
+        rule_id: [row[0] for row in rows if row[0] not in reject]
+        for rule_id, rows in pending.items()
+    }
+
+    approved, conflicts = [], []
+    for change_id in sorted(approve & by_id.keys()):
+        rule_id = by_id[change_id][1]
+        if len(open_changes[rule_id]) > 1:
+            conflicts.append({"change_id": change_id, "rule_id": rule_id, "pending": open_changes[rule_id]})
+        else:
+            approved.append(by_id[change_id])
+    rejected = sorted(reject & by_id.keys())
+
+    updates = [(name, ingredients, risk, rule_id) for _, rule_id, name, ingredients, risk in approved]
+    cur.executemany("UPDATE regulatory_rules SET name=?, ingredients=?, risk_level=? WHERE rule_id=?", updates)
+    sync_rule_ingredients(cur, [(rule_id, ingredients) for _, rule_id, _, ingredients, _ in approved])
+
+    cur.executemany("UPDATE pending_changes SET status='APPROVED' WHERE id=?", [(row[0],) for row in approved])
+    cur.executemany("UPDATE pending_changes SET status='REJECTED' WHERE id=?", [(i,) for i in rejected])
+    if approved:
+        prune_rule_changes(cur)
+
+    return {
+        "approved": [row[0] for row in approved],
+        "rejected": rejected,
+        "conflicts": conflicts,
+        # unknown ids and changes somebody already decided on
+        "skipped": sorted(wanted - by_id.keys()),
+    }
+
+# -------------------------
+# Schema migration
+# -------------------------
+# ensure_rules_schema creates the derived tables empty. derived_tables
+# records which of them have been filled from regulatory_rules, so
+# ensure_schema backfills each one exactly once, whichever script created it.
+def table_exists(cur, name):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cur.fetchone() is not None
+
+def ensure_derived_tables(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS derived_tables (name TEXT PRIMARY KEY)")
+
+def mark_derived(cur, table):
+    cur.execute("INSERT OR IGNORE INTO derived_tables (name) VALUES (?)", (table,))
+
+def is_derived(cur, table):
+    cur.execute("SELECT 1 FROM derived_tables WHERE name = ?", (table,))
+    return cur.fetchone() is not None
+
+def ensure_rules_schema(cur):
+    # everything derived from regulatory_rules that a table swap drops
+    ensure_derived_tables(cur)
+    ensure_rules_version(cur)
+    ensure_rule_changes(cur)
+    ensure_rule_ingredients(cur)
+    ensure_rule_indexes(cur)
+    ensure_rules_fts(cur)
+
+def ensure_schema(db_path):
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+
+    # nothing to migrate before backend.py has created the rules tables
+    if table_exists(cur, "regulatory_rules"):
+        ensure_rules_schema(cur)
+        if not is_derived(cur, "rule_ingredients"):
+            rebuild_rule_ingredients(cur)
+        # also repairs an index created empty by an older backend.py or
+        # repair_ingredients.py run, which its triggers report as malformed
+        if not is_derived(cur, "rules_fts"):
+            rebuild_rules_fts(cur)
+
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    # rebuild derived tables by hand: python rule_store.py [path/to/rules.db]
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "rules.db"
+
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    ensure_rules_schema(cur)
+    rebuild_rule_ingredients(cur)
+    rebuild_rules_fts(cur)
+    conn.commit()
+
+    cur.execute("SELECT COUNT(*) FROM rule_ingredients")
+    print(f"rule_ingredients rebuilt: {cur.fetchone()[0]} rows.")
+    conn.close()
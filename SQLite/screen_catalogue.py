@@ -0,0 +1,209 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from batch_match import match_many
+from matcher import build_verdict, extract_user_ingredients
+from rule_cache import RuleCache
+from rule_store import ensure_schema
+
+SQLITE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SQLITE_DIR)
+RULES_DB = os.path.join(PROJECT_DIR, "rules.db")
+
+# -------------------------
+# Worker side
+# -------------------------
+_rule_cache = None
+
+def init_worker(db_path):
+    global _rule_cache
+    _rule_cache = RuleCache(db_path)
+    _rule_cache.get_index()
+
+def row_error(text):
+    if isinstance(text, RowError):
+        return {"error": text.message}
+    if text is not None and not isinstance(text, str):
+        return {"error": "ingredients must be a string"}
+    return None
+
+def screen_chunk(chunk):
+    index = _rule_cache.get_index()
+
+    # like /check/batch, a bad row gets an error line of its own; every row
+    # still produces exactly one line, so resume offsets stay aligned
+    results = [row_error(text) for _, _, text in chunk]
+    todo = [i for i, r in enumerate(results) if r is None]
+
+    matches = match_many(index, [extract_user_ingredients(chunk[i][2] or "") for i in todo])
+    for i, (exact, related) in zip(todo, matches):
+        results[i] = build_verdict(exact, related)
+
+    lines = []
+    for (row_no, item_id, _), result in zip(chunk, results):
+        result["row"] = row_no
+        result["id"] = item_id
+        lines.append(json.dumps(result) + "\n")
+
+    return "".join(lines)
+
+# -------------------------
+# Input readers (streaming)
+# -------------------------
+class RowError:
+    # stands in for the ingredients of a line that could not be read, so
+    # the row is reported as an error rather than screened as empty
+    def __init__(self, message):
+        self.message = message
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    return "ndjson" if ext in (".ndjson", ".jsonl") else "csv"
+
+def iter_rows(path, fmt, id_column, ingredients_column):
+    with open(path, "r", encoding="utf-8", errors="replace", newline="") as f:
+        if fmt == "csv":
+            for row_no, row in enumerate(csv.DictReader(f)):
+                yield row_no, row.get(id_column), row.get(ingredients_column)
+            return
+
+        for row_no, line in enumerate(f):
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                yield row_no, None, RowError("Invalid JSON line")
+                continue
+            if not isinstance(obj, dict):
+                yield row_no, None, RowError("Item must be an object")
+                continue
+            yield row_no, obj.get(id_column), obj.get(ingredients_column)
+
+def iter_chunks(rows, chunk_size, skip):
+    chunk = []
+    for row in rows:
+        if row[0] < skip:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# -------------------------
+# Resume support
+# -------------------------
+def completed_rows(output_path):
+    # one output line per input row, written in input order. A partially
+    # written last line is cut off so the row is screened again.
+    if not os.path.exists(output_path):
+        return 0
+
+    count = 0
+    last_newline = 0
+    offset = 0
+    with open(output_path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            n = block.count(b"\n")
+            if n:
+                count += n
+                last_newline = offset + block.rindex(b"\n") + 1
+            offset += len(block)
+
+    if last_newline != offset:
+        with open(output_path, "r+b") as f:
+            f.truncate(last_newline)
+
+    return count
+
+# -------------------------
+# Main loop
+# -------------------------
+def report(done, start, final=False):
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    end = "\n" if final else "\r"
+    sys.stderr.write(f"{done} rows screened in {elapsed:.1f}s ({rate:.0f} rows/s){end}")
+    sys.stderr.flush()
+
+def run(args):
+    fmt = args.format or detect_format(args.input)
+    ensure_schema(args.db)
+
+    skip = args.start_row
+    mode = "w"
+    if args.resume:
+        skip += completed_rows(args.output)
+        mode = "a"
+    if skip:
+        print(f"Resuming at row {skip}", file=sys.stderr)
+
+    rows = iter_rows(args.input, fmt, args.id_column, args.ingredients_column)
+    chunks = iter_chunks(rows, args.chunk_size, skip)
+
+    done = 0
+    start = time.perf_counter()
+    last_report = start
+
+    with open(args.output, mode, encoding="utf-8") as out:
+        if args.workers <= 1:
+            init_worker(args.db)
+            results = (screen_chunk(chunk) for chunk in chunks)
+            pool = None
+        else:
+            pool = Pool(args.workers, initializer=init_worker, initargs=(args.db,))
+            results = bounded_imap(pool, chunks, args.workers * 2)
+
+        try:
+            for text in results:
+                out.write(text)
+                out.flush()
+                done += text.count("\n")
+
+                now = time.perf_counter()
+                if now - last_report >= 1.0:
+                    report(done, start)
+                    last_report = now
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    report(done, start, final=True)
+
+def bounded_imap(pool, chunks, max_pending):
+    # Pool.imap drains the whole input up front; keep only a few chunks in
+    # flight so memory stays flat on multi-GB catalogues
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(screen_chunk, (chunk,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Screen a CSV/NDJSON product catalogue against the regulatory rules.")
+    parser.add_argument("input", help="catalogue file (.csv, .ndjson or .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="NDJSON file to write verdicts to")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from extension)")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--ingredients-column", default="ingredients")
+    parser.add_argument("--db", default=RULES_DB, help="rules database")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--start-row", type=int, default=0, help="skip rows before this offset")
+    parser.add_argument("--resume", action="store_true", help="continue after the rows already in --output (counted from --start-row)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    run(parse_args())
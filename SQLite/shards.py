@@ -0,0 +1,123 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from matcher import build_verdict
+from rule_cache import RuleCache
+from rule_snapshot import refresh_snapshot
+from rule_store import ensure_schema
+from verdict_cache import VerdictCache
+
+# -------------------------
+# Jurisdictions
+# -------------------------
+# Each jurisdiction's banned-drug list lives in its own rules database (a
+# shard) with its own index, snapshot and verdict cache. India keeps the
+# original rules.db; other lists are loaded with
+#   python backend.py --jurisdiction US --input fda_list.txt
+JURISDICTIONS = {
+    "IN": {"country": "India", "authority": "CDSCO"},
+    "US": {"country": "United States", "authority": "FDA"},
+    "GB": {"country": "United Kingdom", "authority": "MHRA"},
+    "EU": {"country": "European Union", "authority": "EMA"},
+    "AU": {"country": "Australia", "authority": "TGA"},
+    "CA": {"country": "Canada", "authority": "Health Canada"},
+}
+
+DEFAULT_JURISDICTION = "IN"
+
+# worst first, for the overall status of a multi-country check
+STATUS_ORDER = ("HIGH RISK", "NEEDS REVIEW", "NO MATCH")
+
+def shard_db_name(code):
+    code = code.upper()
+    return "rules.db" if code == DEFAULT_JURISDICTION else f"rules_{code.lower()}.db"
+
+def parse_countries(value):
+    # "IN,US" or ["IN", "US"] -> ["IN", "US"]; order kept, repeats dropped
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        return []
+    codes = []
+    for code in value:
+        code = str(code).strip().upper()
+        if code and code not in codes:
+            codes.append(code)
+    return codes
+
+def worst_status(results):
+    statuses = {r["status"] for r in results}
+    return next((s for s in STATUS_ORDER if s in statuses), "NO MATCH")
+
+# -------------------------
+# Shards
+# -------------------------
+class Shard:
+    def __init__(self, code, db_path):
+        self.code = code
+        self.db_path = db_path
+        self.info = JURISDICTIONS.get(code, {"country": code, "authority": code})
+        self.rule_cache = RuleCache(db_path)
+        self.verdict_cache = VerdictCache()
+
+    @property
+    def authority(self):
+        return self.info["authority"]
+
+    def index(self):
+        return self.rule_cache.get_index()
+
+    def check(self, user_tokens, index=None):
+        if index is None:
+            index = self.index()
+        exact, related = self.verdict_cache.match(index, user_tokens)
+        return build_verdict(list(exact), list(related), self.authority)
+
+
+class ShardSet:
+    # Opens shards on first use. A jurisdiction is available when its
+    # database exists; the default one is always there.
+
+    def __init__(self, rules_dir, workers=len(JURISDICTIONS)):
+        self.rules_dir = rules_dir
+        self.shards = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+
+    def available(self):
+        return [
+            code for code in JURISDICTIONS
+            if code == DEFAULT_JURISDICTION or os.path.exists(os.path.join(self.rules_dir, shard_db_name(code)))
+        ]
+
+    def get(self, code):
+        code = (code or "").upper()
+        shard = self.shards.get(code)
+        if shard is not None:
+            return shard
+
+        db_path = os.path.join(self.rules_dir, shard_db_name(code))
+        if code not in JURISDICTIONS or not (code == DEFAULT_JURISDICTION or os.path.exists(db_path)):
+            return None
+
+        with self.lock:
+            if code not in self.shards:
+                ensure_schema(db_path)
+                refresh_snapshot(db_path)
+                self.shards[code] = Shard(code, db_path)
+            return self.shards[code]
+
+    def default(self):
+        return self.get(DEFAULT_JURISDICTION)
+
+    def indexes(self, shards):
+        # Warm shards answer from memory in microseconds; a shard whose rules
+        # changed reloads from its snapshot or from SQLite, which is file I/O
+        # and releases the GIL. Fetching the indexes side by side keeps a
+        # multi-country check as slow as its slowest shard, not their sum.
+        # Matching itself runs inline: it is pure Python and well under a
+        # millisecond per shard, so threads would only add overhead.
+        if len(shards) < 2:
+            return [shard.index() for shard in shards]
+        return list(self.pool.map(Shard.index, shards))
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# -------------------------
+# Cache config
+# -------------------------
+VERDICT_CACHE_ENTRIES = int(os.environ.get("VERDICT_CACHE_ENTRIES", 10000))
+
+def token_key(user_tokens):
+    # word order, repeats and formatting are already gone from the token
+    # set; sorting makes it canonical
+    return tuple(sorted(user_tokens))
+
+def verdict_etag(version, key, variant=""):
+    digest = hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()[:16]
+    return f"v{version}-{variant}{digest}"
+
+# -------------------------
+# Match cache
+# -------------------------
+class VerdictCache:
+    # LRU of index.match() results keyed on the canonical token set. Entries
+    # belong to one rule index: as soon as a lookup comes in for a different
+    # index (a new rules_version was loaded) the cache starts over.
+
+    def __init__(self, max_entries=VERDICT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.index = None
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+
+    def match(self, index, user_tokens):
+        # (exact, related) as index.match() returns them; callers must not
+        # modify the lists
+        key = token_key(user_tokens)
+
+        with self.lock:
+            if index is self.index:
+                found = self.entries.get(key)
+                if found is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return found
+            self.misses += 1
+
+        found = index.match(key)
+        found = (tuple(found[0]), tuple(found[1]))
+
+        with self.lock:
+            if index is not self.index:
+                if self.index is not None:
+                    self.resets += 1
+                self.index = index
+                self.entries.clear()
+            self.entries[key] = found
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return found
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.index = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.entries),
+            "resets": self.resets,
+        }